@@ -95,6 +95,10 @@ def create_app():
                     logger.info("No tables found, creating initial database...")
                     db.create_all()
                     User.create_default_admin()
+                else:
+                    # Add and backfill columns and indexes introduced since the tables were created
+                    from tools.weather.schema import upgrade_weather_schema
+                    upgrade_weather_schema()
         except Exception as e:
             # Don't fail app startup if database isn't accessible yet
             logger.warning(f"Database initialization skipped: {e}")
@@ -130,6 +134,11 @@ def create_app():
     if ModuleManager.is_module_enabled('weather'):
         from tools.weather import weather_bp
         app.register_blueprint(weather_bp, url_prefix='/tools/weather')
+        
+        # Pin astropy IERS tables at startup so the first request never downloads them
+        if Config.SOLAR_POSITION_BACKEND.lower() == 'astropy':
+            from tools.weather.iers import configure_iers
+            configure_iers(warm_up=True)
         logger.info("Weather module registered")
     else:
         logger.info("Weather module disabled")
@@ -57,6 +57,48 @@ class Config:
     OBSERVATORY_ELEVATION = float(os.environ.get('OBSERVATORY_ELEVATION', 450.0))  # meters above sea level
     OBSERVATORY_TIMEZONE = os.environ.get('OBSERVATORY_TIMEZONE', 'America/Chicago')
     
+    # Solar position backend: 'noaa' (pure NumPy, default) or 'astropy' (reference)
+    SOLAR_POSITION_BACKEND = os.environ.get('SOLAR_POSITION_BACKEND', 'noaa')
+    
+    # Astropy IERS tables: offline mode never downloads; fetch tables with 'flask weather fetch-iers'
+    ASTROPY_IERS_OFFLINE = os.environ.get('ASTROPY_IERS_OFFLINE', 'true').lower() == 'true'
+    ASTROPY_IERS_DIR = os.environ.get('ASTROPY_IERS_DIR', 'instance/iers')
+    
+    # Weather chart pre-rendering: new observations trigger a debounced background render
+    WEATHER_PRERENDER_ENABLED = os.environ.get('WEATHER_PRERENDER_ENABLED', 'true').lower() == 'true'
+    WEATHER_PRERENDER_DELAY = float(os.environ.get('WEATHER_PRERENDER_DELAY', 10))  # seconds
+    WEATHER_PRERENDER_PROFILES = os.environ.get('WEATHER_PRERENDER_PROFILES', 'standard,thumbnail').split(',')  # PNG render profiles
+    WEATHER_CHART_MAX_AGE = int(os.environ.get('WEATHER_CHART_MAX_AGE', 60))  # browser Cache-Control max-age for chart images
+    WEATHER_INGEST_MAX_BATCH = int(os.environ.get('WEATHER_INGEST_MAX_BATCH', 5000))  # observations per batch ingest request
+    WEATHER_HISTORY_MAX_PAGE = int(os.environ.get('WEATHER_HISTORY_MAX_PAGE', 1000))  # most observations per history API page
+    WEATHER_ROLLUP_MIN_POINTS = int(os.environ.get('WEATHER_ROLLUP_MIN_POINTS', 300))  # fewest points a rollup query may return
+    WEATHER_METRICS_TOKEN = os.environ.get('WEATHER_METRICS_TOKEN', '')  # bearer token for scraping /metrics; unset, it needs a login
+    
+    # Retention: observations older than this move from weather_data to date-partitioned archive files
+    WEATHER_RETENTION_DAYS = int(os.environ.get('WEATHER_RETENTION_DAYS', 0))  # days, 0 keeps everything in the table
+    WEATHER_ARCHIVE_PATH = os.environ.get('WEATHER_ARCHIVE_PATH', 'instance/weather_archive')
+    WEATHER_ARCHIVE_CHUNK_SIZE = int(os.environ.get('WEATHER_ARCHIVE_CHUNK_SIZE', 1000))  # rows deleted per transaction
+    
+    # Write-behind ingest: endpoints enqueue and return 202, a background writer group-commits
+    WEATHER_INGEST_WRITE_BEHIND = os.environ.get('WEATHER_INGEST_WRITE_BEHIND', 'false').lower() == 'true'
+    WEATHER_INGEST_QUEUE_SIZE = int(os.environ.get('WEATHER_INGEST_QUEUE_SIZE', 10000))  # observations held before returning 503
+    WEATHER_INGEST_GROUP_SIZE = int(os.environ.get('WEATHER_INGEST_GROUP_SIZE', 500))  # observations per group commit
+    WEATHER_INGEST_GROUP_LATENCY = float(os.environ.get('WEATHER_INGEST_GROUP_LATENCY', 1.0))  # seconds an observation waits for its group
+    
+    # Chart image cache limits (least recently used entries are evicted first)
+    CHART_CACHE_TTL = int(os.environ.get('CHART_CACHE_TTL', 300))  # seconds
+    CHART_CACHE_MAX_ENTRIES = int(os.environ.get('CHART_CACHE_MAX_ENTRIES', 256))
+    CHART_CACHE_MAX_BYTES = int(os.environ.get('CHART_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    CHART_CACHE_SWEEP_INTERVAL = int(os.environ.get('CHART_CACHE_SWEEP_INTERVAL', 60))  # seconds, 0 disables
+    # Shared chart store behind the in-memory cache: 'sqlite' (shared by all workers) or 'memory' (per process)
+    CHART_CACHE_BACKEND = os.environ.get('CHART_CACHE_BACKEND', 'sqlite')
+    CHART_CACHE_PATH = os.environ.get('CHART_CACHE_PATH', 'instance/chart_cache.sqlite')
+    CHART_RENDER_TIMEOUT = float(os.environ.get('CHART_RENDER_TIMEOUT', 30))  # seconds to wait on another render of the same chart
+    
+    # Stale-while-revalidate: serve an expired or superseded chart for up to this long past expiry while it re-renders
+    CHART_CACHE_MAX_STALE = int(os.environ.get('CHART_CACHE_MAX_STALE', 600))  # seconds, 0 disables
+    CHART_RENDER_BUDGET = float(os.environ.get('CHART_RENDER_BUDGET', 2.0))  # seconds a request waits for a render, 0 waits
+    
     # Admin Authentication
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'your_new_secure_password_here')
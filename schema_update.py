@@ -26,6 +26,17 @@ def update_schema():
         # This will only create tables that are missing, not modify existing ones
         db.create_all()
         
+        # Add and backfill new columns and indexes on existing tables
+        from tools.weather.schema import migrate_weather_data, upgrade_weather_schema
+        upgrade_weather_schema()
+        
+        # Remove duplicate observations, add the unique (date, time) index and stop id reuse
+        result = migrate_weather_data()
+        for row_id, date, time in result['removed_duplicates']:
+            print(f"Removed duplicate observation {date} {time} (id {row_id})")
+        if result['rebuilt_ids']:
+            print("Rebuilt weather_data with AUTOINCREMENT ids")
+        
         # Check tables after update
         inspector = db.inspect(db.engine)
         updated_tables = inspector.get_table_names()
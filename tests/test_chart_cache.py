@@ -0,0 +1,54 @@
+"""Single-flight rendering in ChartCache."""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from tools.weather.chart_cache import ChartCache
+from tools.weather.chart_store import SQLiteChartStore
+
+CONCURRENT_REQUESTS = 16
+
+def _counting_render(image_data=b'chart'):
+    """A slow render function that counts its calls."""
+    calls = []
+    lock = threading.Lock()
+
+    def render():
+        with lock:
+            calls.append(1)
+        time.sleep(0.2)  # Long enough for every other request to miss too
+        return image_data
+
+    return render, calls
+
+def _miss_together(caches, render):
+    """Call get_or_render for the same key from many threads released at once."""
+    barrier = threading.Barrier(CONCURRENT_REQUESTS)
+
+    def request(index):
+        barrier.wait()
+        return caches[index % len(caches)].get_or_render('temperature', 'standard', 'png', 'window', 1, render)
+
+    with ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS) as executor:
+        return list(executor.map(request, range(CONCURRENT_REQUESTS)))
+
+def test_simultaneous_misses_render_once():
+    cache = ChartCache(sweep_interval=0)
+    render, calls = _counting_render()
+
+    results = _miss_together([cache], render)
+
+    assert len(calls) == 1
+    assert results == [(b'chart', True)] * CONCURRENT_REQUESTS
+    assert cache.get_stats()['coalesced_renders'] == CONCURRENT_REQUESTS - 1
+
+def test_simultaneous_misses_across_workers_render_once(tmp_path):
+    # Each ChartCache stands in for one worker process sharing the store
+    store_path = str(tmp_path / 'charts.db')
+    caches = [ChartCache(sweep_interval=0, store=SQLiteChartStore(store_path)) for _ in range(4)]
+    render, calls = _counting_render()
+
+    results = _miss_together(caches, render)
+
+    assert len(calls) == 1
+    assert results == [(b'chart', True)] * CONCURRENT_REQUESTS
@@ -0,0 +1,54 @@
+"""Concurrent chart rendering with WeatherChartGenerator."""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import random
+from tools.weather.chart_generator import WeatherChartGenerator
+
+CHART_METHODS = ['generate_temperature_chart', 'generate_humidity_chart', 'generate_wind_speed_chart']
+
+def _observations(seed):
+    """A day of five-minute observations with seeded random values."""
+    rnd = random.Random(seed)
+    start = datetime(2025, 6, 1, 12, 0)
+    rows = []
+    for i in range(288):
+        moment = start + timedelta(minutes=5 * i)
+        rows.append({
+            'date': moment.strftime('%Y-%m-%d'),
+            'time': moment.strftime('%H:%M:%S'),
+            'temperature_f': 60 + rnd.random() * 10,
+            'dew_point_f': 40 + rnd.random(),
+            'sky_temperature_f': rnd.random(),
+            'humidity_percent': 50 + rnd.random() * 30,
+            'wind_speed_mph': rnd.random() * 10,
+        })
+    return rows
+
+def _zones():
+    start = datetime(2025, 6, 1, 12, 0)
+    zones = ['day', 'civil_twilight', 'nautical_twilight', 'astronomical_twilight', 'night']
+    return [{'zone': zone, 'start': start + timedelta(hours=2 * i), 'end': start + timedelta(hours=2 * i + 2)}
+            for i, zone in enumerate(zones + zones[::-1])]
+
+def test_charts_render_identically_from_many_threads():
+    generator = WeatherChartGenerator()
+    zones = _zones()
+    datasets = {seed: _observations(seed) for seed in range(2)}
+    expected = {(seed, method): getattr(generator, method)(datasets[seed], zones)
+                for seed in datasets for method in CHART_METHODS}
+
+    jobs = list(expected) * 3
+    random.Random(0).shuffle(jobs)
+
+    def render(job):
+        seed, method = job
+        return job, getattr(WeatherChartGenerator(), method)(datasets[seed], zones)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(render, jobs))
+
+    assert len(results) == len(jobs)
+    for job, image_data in results:
+        assert image_data.startswith(b'\x89PNG')
+        assert image_data == expected[job], f"{job} differs when rendered concurrently"
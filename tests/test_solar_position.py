@@ -0,0 +1,24 @@
+"""Accuracy of the NOAA solar position backend against the astropy reference."""
+
+from datetime import datetime, timezone
+import numpy as np
+import pytest
+from config import Config
+from tools.weather.solar_position import NOAASolarPosition
+
+# Darkness zones only need the sun's altitude to about 0.1 degrees
+MAX_ALTITUDE_ERROR = 0.1
+
+def test_noaa_matches_astropy_over_a_year():
+    pytest.importorskip('astropy')
+    from tools.weather.solar_position import AstropySolarPosition
+
+    location = (Config.OBSERVATORY_LATITUDE, Config.OBSERVATORY_LONGITUDE, Config.OBSERVATORY_ELEVATION)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()
+    unix_seconds = start + np.arange(0, 365 * 86400, 3600, dtype=float)
+
+    expected = AstropySolarPosition(*location).altitudes(unix_seconds)
+    actual = NOAASolarPosition(*location).altitudes(unix_seconds)
+
+    error = np.abs(actual - expected)
+    assert error.max() < MAX_ALTITUDE_ERROR, f"max error {error.max():.4f} deg at {unix_seconds[error.argmax()]}"
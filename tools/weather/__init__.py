@@ -1,3 +1,4 @@
 from .routes import weather_bp
+from . import cli  # Registers 'flask weather' commands on the blueprint
 
-__all__ = ['weather_bp']
\ No newline at end of file
+__all__ = ['weather_bp']
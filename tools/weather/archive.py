@@ -0,0 +1,334 @@
+"""
+Archive of weather observations older than the retention period.
+Each UTC day of observations is one partition directory under the archive
+path, holding one uncompressed .npy file per weather_data column, sorted by
+observed_at and id. String columns are dictionary encoded (integer codes
+plus a small categories file). Uncompressed columns let reads memory-map a
+file and copy out only the rows in the requested time range.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+import logging
+import os
+import shutil
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import Boolean, DateTime, Float, Integer, delete, func, select
+from config import Config
+from .metrics import get_metrics, timed
+from .models import WeatherData, db
+
+logger = logging.getLogger(__name__)
+
+def _column_kinds() -> Dict[str, str]:
+    """Map each weather_data column to how it is stored: int, float, bool, datetime or string."""
+    kinds = {}
+    for column in WeatherData.__table__.c:
+        if isinstance(column.type, Boolean):
+            kinds[column.name] = 'bool'
+        elif isinstance(column.type, Integer):
+            kinds[column.name] = 'int'
+        elif isinstance(column.type, Float):
+            kinds[column.name] = 'float'
+        elif isinstance(column.type, DateTime):
+            kinds[column.name] = 'datetime'
+        else:
+            kinds[column.name] = 'string'
+    return kinds
+
+class WeatherArchive:
+    """Date-partitioned columnar files of archived weather observations."""
+
+    def __init__(self, path: str):
+        """
+        Initialize the archive.
+
+        Args:
+            path: Directory holding one subdirectory per archived UTC day
+        """
+        self.path = path
+        self.kinds = _column_kinds()
+
+    def partitions(self) -> List[date]:
+        """Get the archived UTC days, oldest first."""
+        if not os.path.isdir(self.path):
+            return []
+
+        days = []
+        for name in os.listdir(self.path):
+            try:
+                days.append(date.fromisoformat(name))
+            except ValueError:
+                continue  # Temporary directories of an interrupted write
+        return sorted(days)
+
+    def max_id(self) -> int:
+        """Get the highest weather_data id in the archive (0 when empty)."""
+        highest = 0
+        for day in self.partitions():
+            row_ids = np.load(os.path.join(self._partition_path(day), 'id.npy'), mmap_mode='r')
+            if len(row_ids):
+                highest = max(highest, int(row_ids.max()))
+        return highest
+
+    def find_ids(self, rows: Iterable[Dict[str, Any]]) -> Dict[Tuple[str, str], int]:
+        """
+        Find observations that are already archived.
+
+        Args:
+            rows: weather_data rows with date, time and observed_at (naive UTC)
+
+        Returns:
+            Dictionary of (date, time) to archived id, for the rows found in the archive
+        """
+        archived_days = set(self.partitions())
+        wanted: Dict[date, set] = {}
+        for row in rows:
+            if row['observed_at'] is not None and row['observed_at'].date() in archived_days:
+                wanted.setdefault(row['observed_at'].date(), set()).add((row['date'], row['time']))
+
+        found = {}
+        for day, keys in wanted.items():
+            arrays = self._arrays(day, ['date', 'time', 'id'], slice(None))
+            for row_date, row_time, row_id in zip(arrays['date'].tolist(), arrays['time'].tolist(),
+                                                  arrays['id'].tolist()):
+                if (row_date, row_time) in keys:
+                    found[(row_date, row_time)] = row_id
+        return found
+
+    def _partition_path(self, day: date) -> str:
+        return os.path.join(self.path, day.isoformat())
+
+    def _arrays(self, day: date, columns: Sequence[str], rows) -> Dict[str, np.ndarray]:
+        """Load the given rows (a slice or index array) of some columns of one partition, mapping the column files."""
+        directory = self._partition_path(day)
+        data = {}
+        for name in columns:
+            values = np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')[rows]
+            if self.kinds[name] == 'string':
+                categories = np.load(os.path.join(directory, f'{name}.categories.npy'))
+                data[name] = categories[values]
+            else:
+                data[name] = np.array(values)  # Copy the rows out of the map
+        return data
+
+    def _load(self, day: date, columns: Sequence[str], rows) -> pd.DataFrame:
+        """Load the given rows of some columns of one partition as a DataFrame."""
+        return pd.DataFrame(self._arrays(day, columns, rows))
+
+    def _bounds(self, day: date, start: Optional[datetime], end: Optional[datetime]) -> Tuple[np.ndarray, int, int]:
+        """Find the rows of one partition with observed_at in [start, end) by binary search."""
+        observed_at = np.load(os.path.join(self._partition_path(day), 'observed_at.npy'), mmap_mode='r')
+        low = 0 if start is None else int(np.searchsorted(observed_at, np.datetime64(start, 'us'), 'left'))
+        high = len(observed_at) if end is None else int(np.searchsorted(observed_at, np.datetime64(end, 'us'), 'left'))
+        return observed_at, low, high
+
+    def _read_partition(self, day: date, start: Optional[datetime], end: Optional[datetime],
+                        columns: Sequence[str]) -> pd.DataFrame:
+        """Read rows with observed_at in [start, end) from one partition."""
+        _, low, high = self._bounds(day, start, end)
+        return self._load(day, columns, slice(low, high))
+
+    @timed('weather_archive_read_seconds')
+    def read(self, start: datetime, end: Optional[datetime] = None,
+             columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Read archived observations with observed_at in [start, end) (naive UTC; no end bound when end is None).
+
+        Args:
+            columns: weather_data column names to read (defaults to all columns)
+
+        Returns:
+            DataFrame with one column per weather_data column, oldest first
+        """
+        columns = list(columns) if columns else list(self.kinds)
+        days = [day for day in self.partitions()
+                if day >= start.date() and (end is None or day <= end.date())]
+
+        frames = [self._read_partition(day, start, end, columns) for day in days]
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    @timed('weather_archive_read_seconds')
+    def read_page(self, start: Optional[datetime], end: Optional[datetime], before: Optional[Tuple[datetime, int]],
+                  limit: int, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Read up to limit archived observations, newest first, for keyset pagination.
+
+        Partitions are visited newest first and each is binary searched, so a
+        page costs the same however far back it starts.
+
+        Args:
+            start: Oldest observed_at to include (naive UTC), or None
+            end: observed_at to stop before (naive UTC), or None
+            before: Only rows ordered before this (observed_at, id) key, or None
+            limit: Most rows to return
+            columns: weather_data column names to read (defaults to all columns)
+
+        Returns:
+            DataFrame ordered by (observed_at, id) descending
+        """
+        columns = list(columns) if columns else list(self.kinds)
+        frames = []
+        remaining = limit
+        for day in reversed(self.partitions()):
+            if remaining <= 0 or (start is not None and day < start.date()):
+                break
+            if (end is not None and day > end.date()) or (before is not None and day > before[0].date()):
+                continue
+
+            upper = end
+            if before is not None and (upper is None or before[0] < upper):
+                upper = before[0] + timedelta(microseconds=1)  # Rows at the cursor time are filtered by id below
+            observed_at, low, high = self._bounds(day, start, upper)
+            if high <= low:
+                continue
+
+            rows = np.arange(low, high)
+            if before is not None:
+                row_ids = np.load(os.path.join(self._partition_path(day), 'id.npy'), mmap_mode='r')[low:high]
+                at_cursor = observed_at[low:high] == np.datetime64(before[0], 'us')
+                rows = rows[~at_cursor | (row_ids < before[1])]
+            rows = rows[::-1][:remaining]
+
+            frames.append(self._load(day, columns, rows))
+            remaining -= len(rows)
+
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def iter_rows(self, start: Optional[datetime], end: Optional[datetime],
+                  chunk_size: int = 1000) -> Iterator[Tuple[Any, ...]]:
+        """
+        Stream archived observations with observed_at in [start, end), oldest first.
+
+        Only chunk_size rows are copied out of the mapped files at a time.
+
+        Yields:
+            Tuples of native Python values in weather_data column order
+        """
+        columns = list(self.kinds)
+        for day in self.partitions():
+            if start is not None and day < start.date():
+                continue
+            if end is not None and day > end.date():
+                break
+
+            _, low, high = self._bounds(day, start, end)
+            for chunk_start in range(low, high, chunk_size):
+                arrays = self._arrays(day, columns, slice(chunk_start, min(chunk_start + chunk_size, high)))
+                # tolist() gives datetime for datetime64[us] and None for NaT
+                yield from zip(*(arrays[name].tolist() for name in columns))
+
+    def write(self, day: date, frame: pd.DataFrame) -> int:
+        """
+        Add observations from one UTC day to its partition, merging with rows already archived.
+
+        The partition is written to a temporary directory and swapped in, so
+        readers never see a partial partition. Rows whose (date, time) is
+        already archived are kept once.
+
+        Returns:
+            Number of rows in the partition
+        """
+        final_path = self._partition_path(day)
+        if os.path.isdir(final_path):
+            existing = self._read_partition(day, None, None, list(self.kinds))
+            frame = pd.concat([existing, frame[list(self.kinds)]], ignore_index=True)
+        frame = (frame.drop_duplicates(['date', 'time'], keep='first')
+                 .sort_values(['observed_at', 'id'], kind='stable')
+                 .reset_index(drop=True))
+
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = os.path.join(self.path, f'.{day.isoformat()}.{os.getpid()}.tmp')
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+
+        for name, kind in self.kinds.items():
+            column = frame[name]
+            if kind == 'string':
+                codes, categories = pd.factorize(column)
+                np.save(os.path.join(temp_path, f'{name}.npy'), codes.astype(np.int32))
+                np.save(os.path.join(temp_path, f'{name}.categories.npy'), np.asarray(categories, dtype=str))
+            elif kind == 'datetime':
+                np.save(os.path.join(temp_path, f'{name}.npy'), column.to_numpy(dtype='datetime64[us]'))
+            elif kind == 'bool':
+                np.save(os.path.join(temp_path, f'{name}.npy'), column.to_numpy(dtype=bool))
+            elif kind == 'int':
+                np.save(os.path.join(temp_path, f'{name}.npy'), column.to_numpy(dtype=np.int64))
+            else:
+                np.save(os.path.join(temp_path, f'{name}.npy'), column.to_numpy(dtype=np.float64))
+
+        if os.path.isdir(final_path):
+            old_path = os.path.join(self.path, f'.{day.isoformat()}.{os.getpid()}.old')
+            os.replace(final_path, old_path)
+            os.replace(temp_path, final_path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(temp_path, final_path)
+
+        return len(frame)
+
+def archive_old_observations(max_age_days: int, chunk_size: int = 1000) -> int:
+    """
+    Move observations older than max_age_days from weather_data into the archive.
+
+    Whole UTC days are archived, oldest first. Each day's partition is
+    written before its rows are deleted, and rows are deleted chunk_size at a
+    time with a commit after each chunk to keep write locks short. An
+    interrupted run is safe to repeat: rows archived but not yet deleted are
+    merged into the partition again without duplicates.
+
+    Returns:
+        Number of observations archived
+    """
+    archive = get_weather_archive()
+    table = WeatherData.__table__
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = datetime.combine((now - timedelta(days=max_age_days)).date(), datetime.min.time())
+
+    archived = 0
+    while True:
+        first = db.session.execute(
+            select(func.min(table.c.observed_at)).where(table.c.observed_at < cutoff)
+        ).scalar()
+        if first is None:
+            break
+
+        day_start = datetime.combine(first.date(), datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        result = db.session.execute(
+            select(table)
+            .where(table.c.observed_at >= day_start, table.c.observed_at < day_end)
+            .order_by(table.c.observed_at)
+        )
+        frame = pd.DataFrame(result.all(), columns=list(result.keys()))
+        db.session.rollback()  # End the read transaction before writing files
+
+        archive.write(first.date(), frame)
+
+        ids = frame['id'].tolist()
+        for start in range(0, len(ids), chunk_size):
+            db.session.execute(delete(table).where(table.c.id.in_(ids[start:start + chunk_size])))
+            db.session.commit()
+
+        archived += len(ids)
+        get_metrics().inc('weather_archive_rows_total', len(ids))
+        logger.info(f"Archived {len(ids)} weather observations from {first.date()}")
+
+    return archived
+
+# Global archive instance
+_weather_archive = None
+
+def get_weather_archive() -> WeatherArchive:
+    """Get the global weather archive."""
+    global _weather_archive
+    if _weather_archive is None:
+        _weather_archive = WeatherArchive(Config.WEATHER_ARCHIVE_PATH)
+    return _weather_archive
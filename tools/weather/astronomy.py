@@ -3,14 +3,12 @@ Astronomical calculations for weather monitoring system.
 Provides twilight calculations and darkness zone classifications.
 """
 
-from datetime import datetime, timezone
+from datetime import datetime
 import logging
-from typing import Dict, List, Tuple
-from astropy.time import Time
-from astropy.coordinates import EarthLocation, AltAz, get_sun
-from astropy import units as u
+import numpy as np
 from config import Config
-from timezone_utils import to_utc, to_central
+from .solar_position import get_solar_position_backend
+from timezone_utils import to_utc
 
 logger = logging.getLogger(__name__)
 
@@ -28,10 +26,11 @@ class AstronomyCalculator:
         
         logger.info(f"Astronomy calculator initialized for location: {self.latitude} degrees, {self.longitude} degrees, {self.elevation}m")
         
-        self.location = EarthLocation(
-            lat=self.latitude * u.deg,
-            lon=self.longitude * u.deg,
-            height=self.elevation * u.m
+        self.backend = get_solar_position_backend(
+            Config.SOLAR_POSITION_BACKEND,
+            self.latitude,
+            self.longitude,
+            self.elevation
         )
     
     def get_sun_altitude(self, dt: datetime) -> float:
@@ -44,15 +43,17 @@ class AstronomyCalculator:
         Returns:
             Sun altitude in degrees (negative means below horizon)
         """
-        # Convert Central time to UTC for astropy calculations
+        # Convert Central time to UTC for the solar position backend
         dt_utc = to_utc(dt)
         
-        time = Time(dt_utc)
-        sun = get_sun(time)
-        altaz_frame = AltAz(obstime=time, location=self.location)
-        sun_altaz = sun.transform_to(altaz_frame)
+        return float(self._sun_altitudes_at(np.array([dt_utc.timestamp()]))[0])
+    
+    def _sun_altitudes_at(self, unix_seconds: np.ndarray) -> np.ndarray:
+        """Calculate sun altitudes (degrees) for an array of UTC unix timestamps."""
+        if unix_seconds.size == 0:
+            return np.empty(0)
         
-        return sun_altaz.alt.degree
+        return self.backend.altitudes(unix_seconds)
     
     def classify_darkness_zone(self, sun_altitude: float) -> str:
         """
@@ -111,38 +112,3 @@ class AstronomyCalculator:
             "unknown": "rgba(128, 128, 128, 0.1)"         # Light gray
         }
         return zone_colors.get(zone, zone_colors["unknown"])
-    
-    def calculate_zones_for_timerange(self, start_time: datetime, end_time: datetime, 
-                                    interval_minutes: int = 15) -> List[Dict]:
-        """
-        Calculate darkness zones for a time range.
-        
-        Args:
-            start_time: Start of time range
-            end_time: End of time range
-            interval_minutes: Interval between calculations in minutes
-            
-        Returns:
-            List of dictionaries with time, zone, and color information
-        """
-        zones = []
-        current_time = start_time
-        
-        while current_time <= end_time:
-            zone = self.get_darkness_zone(current_time)
-            color = self.get_zone_color(zone)
-            sun_alt = self.get_sun_altitude(current_time)
-            
-            zones.append({
-                'time': current_time,
-                'zone': zone,
-                'color': color,
-                'timestamp': to_utc(current_time).timestamp() * 1000,  # Convert to UTC first for consistent timestamps
-                'sun_altitude': sun_alt  # For debugging
-            })
-            
-            # Move to next interval
-            from datetime import timedelta
-            current_time += timedelta(minutes=interval_minutes)
-        
-        return zones
\ No newline at end of file
@@ -1,113 +1,378 @@
 """
 Chart caching system for weather data images.
 Caches generated chart images for a specified duration to improve performance.
+Entries are keyed on the chart variant and the weather data version, so a
+new observation invalidates exactly the charts it affects.
+Bounded by entry count and total bytes, with least-recently-used eviction.
+Concurrent misses for the same key are coalesced into a single render, and
+expired or superseded images can be served while a refresh runs in the
+background (stale-while-revalidate).
+An optional shared store sits behind the in-memory cache so that all worker
+processes reuse each other's charts.
 """
 
 import time
-import hashlib
-import json
 import logging
-from typing import Dict, Optional, Any
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Any, Tuple
 from datetime import datetime, timedelta
+from config import Config
+from .chart_store import ChartStore, create_chart_store
+from .metrics import get_metrics
 
 logger = logging.getLogger(__name__)
 
+class _RenderFlight:
+    """An in-progress render that other callers for the same key wait on."""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.image_data: Optional[bytes] = None
+
 class ChartCache:
-    """Simple in-memory cache for chart images."""
+    """Thread-safe, size-bounded LRU in-memory cache for chart images, optionally backed by a shared store."""
     
-    def __init__(self, default_ttl: int = 300):  # 5 minutes default
-        """Initialize the cache with default TTL in seconds."""
-        self.cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, default_ttl: int = 300, max_entries: int = 256,
+                 max_bytes: int = 64 * 1024 * 1024, sweep_interval: float = 60,
+                 store: Optional[ChartStore] = None, render_timeout: float = 30,
+                 max_stale: float = 0, render_budget: float = 0):
+        """
+        Initialize the cache.
+        
+        Args:
+            default_ttl: Entry lifetime in seconds
+            max_entries: Maximum number of entries before evicting the least recently used
+            max_bytes: Maximum total image bytes before evicting the least recently used
+            sweep_interval: Seconds between background expiry sweeps (0 disables the sweeper)
+            store: Shared store consulted on in-memory misses and written through on set
+            render_timeout: Seconds to wait for another thread or worker's render before rendering anyway
+            max_stale: Seconds past expiry an image may still be served while it is refreshed (0 disables)
+            render_budget: Seconds a request waits for a render before falling back to the last good image (0 waits)
+        """
+        # Ordered from least to most recently used
+        self.cache: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
         self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+        self.store = store
+        self.render_timeout = render_timeout
+        self.max_stale = max_stale
+        self.render_budget = render_budget
+        self.inflight: Dict[str, _RenderFlight] = {}
+        self.coalesced = 0
+        self.stale_served = 0
+        self.budget_fallbacks = 0
+        
+        # Cache key of the most recently stored version of each chart variant
+        self.latest: Dict[str, str] = {}
+        
+        self._stop_sweeper = threading.Event()
+        if sweep_interval > 0:
+            sweeper = threading.Thread(target=self._sweep, args=(sweep_interval,),
+                                       name='chart-cache-sweeper', daemon=True)
+            sweeper.start()
     
-    def _generate_cache_key(self, chart_type: str, historical_data: list, astronomical_zones: list) -> str:
-        """Generate a unique cache key based on chart type and data."""
-        # Create a hash of the data to use as cache key
-        data_for_hash = {
-            'chart_type': chart_type,
-            'data_count': len(historical_data),
-            'data_hash': self._hash_data(historical_data),
-            'zones_hash': self._hash_data(astronomical_zones)
-        }
+    def _sweep(self, interval: float) -> None:
+        """Periodically remove expired entries (runs in a daemon thread)."""
+        while not self._stop_sweeper.wait(interval):
+            try:
+                self.clear_expired()
+                if self.store is not None:
+                    self.store.clear_expired(self.max_stale)
+            except Exception as e:
+                logger.error(f"Error sweeping chart cache: {e}")
+    
+    def stop(self) -> None:
+        """Stop the background expiry sweeper."""
+        self._stop_sweeper.set()
+    
+    def _remove(self, cache_key: str) -> None:
+        """Remove an entry and update byte accounting. Caller must hold the lock."""
+        entry = self.cache.pop(cache_key)
+        self.total_bytes -= len(entry['image_data'])
+    
+    def _set_local(self, cache_key: str, entry: Dict[str, Any]) -> None:
+        """Insert an entry into the in-memory cache and evict down to the limits."""
+        with self.lock:
+            if cache_key in self.cache:
+                self._remove(cache_key)
+            
+            self.cache[cache_key] = entry
+            self.total_bytes += len(entry['image_data'])
+            
+            variant_key = cache_key.rsplit(':', 1)[0]
+            current = self.cache.get(self.latest.get(variant_key, ''))
+            if current is None or current['created_at'] <= entry['created_at']:
+                self.latest[variant_key] = cache_key
+            
+            # Evict least recently used entries until within both limits
+            while len(self.cache) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.cache)))
+                self.evictions += 1
+    
+    def _variant_key(self, chart_type: str, profile: str, image_format: str, window: str) -> str:
+        """Build the version-independent key of a chart variant."""
+        return f"{chart_type}:{profile}:{image_format}:{window}"
+    
+    def _cache_key(self, chart_type: str, profile: str, image_format: str, window: str, data_version: int) -> str:
+        """Build the cache key for a chart variant rendered from a given data version."""
+        return f"{self._variant_key(chart_type, profile, image_format, window)}:v{data_version}"
+    
+    def _lookup(self, cache_key: str, max_stale: float = 0) -> Optional[Dict[str, Any]]:
+        """Find an entry in memory, then in the shared store, at most max_stale seconds past expiry."""
+        metrics = get_metrics()
+        with metrics.timer('chart_cache_get_seconds'):
+            entry, tier = self._lookup_tiers(cache_key, max_stale)
+        metrics.inc('chart_cache_lookups_total', tier=tier)
+        return entry
+    
+    def _lookup_tiers(self, cache_key: str, max_stale: float) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Find an entry, returning it with the tier that answered ('memory', 'shared' or 'miss')."""
+        with self.lock:
+            entry = self.cache.get(cache_key)
+            if entry is not None and time.time() < entry['expires_at'] + max_stale:
+                self.cache.move_to_end(cache_key)
+                return entry, 'memory'
         
-        # Create hash of the combined data
-        key_string = json.dumps(data_for_hash, sort_keys=True)
-        return hashlib.md5(key_string.encode()).hexdigest()
-    
-    def _hash_data(self, data: list) -> str:
-        """Create a hash of data for cache key generation."""
-        if not data:
-            return "empty"
-        
-        # For historical data, hash based on first/last timestamps and count
-        if isinstance(data, list) and data:
-            if isinstance(data[0], dict) and 'created_at' in data[0]:
-                # Historical weather data
-                hash_data = {
-                    'count': len(data),
-                    'first': data[0].get('created_at', ''),
-                    'last': data[-1].get('created_at', ''),
-                    'sample_temp': data[0].get('temperature_f', 0) if data else 0
-                }
-            else:
-                # Astronomical zones
-                hash_data = {
-                    'count': len(data),
-                    'first': data[0].get('timestamp', 0) if data else 0,
-                    'last': data[-1].get('timestamp', 0) if data else 0
-                }
+        if self.store is not None:
+            try:
+                entry = self.store.get(cache_key, max_stale)
+            except Exception as e:
+                logger.warning(f"Shared chart cache read failed: {e}")
+                entry = None
             
-            return hashlib.md5(json.dumps(hash_data, sort_keys=True).encode()).hexdigest()[:8]
+            if entry is not None:
+                self._set_local(cache_key, entry)
+                return entry, 'shared'
+        
+        return None, 'miss'
+    
+    def _latest_entry(self, variant_key: str) -> Optional[Dict[str, Any]]:
+        """Find the most recently stored entry of a chart variant, whatever its data version or age."""
+        with self.lock:
+            entry = self.cache.get(self.latest.get(variant_key, ''))
+        if entry is not None or self.store is None:
+            return entry
         
-        return "empty"
+        try:
+            return self.store.get_latest(f"{variant_key}:v")
+        except Exception as e:
+            logger.warning(f"Shared chart cache read failed: {e}")
+            return None
     
-    def get(self, chart_type: str, historical_data: list, astronomical_zones: list) -> Optional[str]:
+    def get(self, chart_type: str, profile: str, image_format: str, window: str,
+            data_version: int) -> Optional[bytes]:
         """Get cached chart image if available and not expired."""
-        cache_key = self._generate_cache_key(chart_type, historical_data, astronomical_zones)
+        cache_key = self._cache_key(chart_type, profile, image_format, window, data_version)
         
-        if cache_key in self.cache:
-            cache_entry = self.cache[cache_key]
-            
-            # Check if cache entry has expired
-            if time.time() < cache_entry['expires_at']:
-                logger.debug(f"Cache hit for {chart_type} chart (key: {cache_key[:8]}...)")
-                return cache_entry['image_data']
-            else:
-                # Remove expired entry
-                logger.debug(f"Cache expired for {chart_type} chart (key: {cache_key[:8]}...)")
-                del self.cache[cache_key]
+        entry = self._lookup(cache_key)
+        if entry is not None:
+            logger.debug(f"Cache hit for {chart_type} chart (key: {cache_key})")
+            return entry['image_data']
         
-        logger.debug(f"Cache miss for {chart_type} chart (key: {cache_key[:8]}...)")
+        logger.debug(f"Cache miss for {chart_type} chart (key: {cache_key})")
         return None
     
-    def set(self, chart_type: str, historical_data: list, astronomical_zones: list, 
-            image_data: str, ttl: Optional[int] = None) -> None:
+    def set(self, chart_type: str, profile: str, image_format: str, window: str, data_version: int,
+            image_data: bytes, ttl: Optional[int] = None) -> None:
         """Store chart image in cache with TTL."""
         if not image_data:
             return
         
-        cache_key = self._generate_cache_key(chart_type, historical_data, astronomical_zones)
+        if len(image_data) > self.max_bytes:
+            logger.warning(f"Not caching {chart_type} chart: {len(image_data)} bytes exceeds cache size limit")
+            return
+        
+        cache_key = self._cache_key(chart_type, profile, image_format, window, data_version)
         expires_at = time.time() + (ttl or self.default_ttl)
         
-        self.cache[cache_key] = {
+        entry = {
             'image_data': image_data,
             'created_at': time.time(),
             'expires_at': expires_at,
-            'chart_type': chart_type
+            'chart_type': chart_type,
+            'profile': profile,
+            'image_format': image_format
         }
+        with get_metrics().timer('chart_cache_set_seconds'):
+            self._set_local(cache_key, entry)
+            
+            if self.store is not None:
+                try:
+                    self.store.set(cache_key, entry)
+                except Exception as e:
+                    logger.warning(f"Shared chart cache write failed: {e}")
         
         logger.debug(f"Cached {chart_type} chart (key: {cache_key[:8]}..., expires in {ttl or self.default_ttl}s)")
     
+    def get_or_render(self, chart_type: str, profile: str, image_format: str, window: str,
+                      data_version: int, render: Callable[[], bytes]) -> Tuple[Optional[bytes], bool]:
+        """
+        Get a cached chart image, rendering it on a miss.
+        
+        Only one render per key runs at a time: other threads that miss on the
+        same key wait for its result, and with a shared store other workers
+        wait on a render lease and then read the image from the store.
+        
+        With max_stale set, an expired image, or the image of an older data
+        version, is returned right away while a background refresh runs. With
+        render_budget set, a request waits at most that long for a render and
+        then falls back to the last good image; the render carries on and
+        fills the cache for later requests.
+        
+        Args:
+            render: Produces the image bytes when nobody else is rendering this key
+        
+        Returns:
+            Tuple of (image bytes, or None if there is nothing to serve yet; whether the image is fresh)
+        """
+        cache_key = self._cache_key(chart_type, profile, image_format, window, data_version)
+        variant_key = self._variant_key(chart_type, profile, image_format, window)
+        
+        metrics = get_metrics()
+        
+        entry = self._lookup(cache_key, self.max_stale)
+        if entry is not None and time.time() < entry['expires_at']:
+            metrics.inc('chart_cache_requests_total', result='hit')
+            return entry['image_data'], True
+        
+        last_good = entry or self._latest_entry(variant_key)
+        if (self.max_stale > 0 and last_good is not None and
+                time.time() < last_good['expires_at'] + self.max_stale):
+            self._refresh_async(chart_type, profile, image_format, window, data_version, cache_key, render)
+            with self.lock:
+                self.stale_served += 1
+            metrics.inc('chart_cache_requests_total', result='stale')
+            logger.debug(f"Serving stale {chart_type} chart while refreshing (key: {cache_key})")
+            return last_good['image_data'], False
+        
+        if self.render_budget <= 0:
+            image_data = self._single_flight(chart_type, profile, image_format, window, data_version,
+                                             cache_key, render)
+            if image_data:
+                metrics.inc('chart_cache_requests_total', result='rendered')
+                return image_data, True
+        else:
+            flight = self._refresh_async(chart_type, profile, image_format, window, data_version,
+                                         cache_key, render)
+            if flight.done.wait(self.render_budget) and flight.image_data:
+                metrics.inc('chart_cache_requests_total', result='rendered')
+                return flight.image_data, True
+            with self.lock:
+                self.budget_fallbacks += 1
+            logger.warning(f"{chart_type} chart not rendered within {self.render_budget}s budget, "
+                           f"serving last good image or placeholder")
+        
+        metrics.inc('chart_cache_requests_total', result='fallback' if last_good is not None else 'placeholder')
+        return (last_good['image_data'] if last_good is not None else None), False
+    
+    def _begin_flight(self, cache_key: str) -> Tuple[_RenderFlight, bool]:
+        """Join the in-progress render for a key, or start one. Returns (flight, whether we lead it)."""
+        with self.lock:
+            flight = self.inflight.get(cache_key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self.inflight[cache_key] = _RenderFlight()
+            return flight, True
+    
+    def _run_flight(self, flight: _RenderFlight, chart_type: str, profile: str, image_format: str,
+                    window: str, data_version: int, cache_key: str, render: Callable[[], bytes]) -> None:
+        """Render as the leader of a flight and wake everyone waiting on it."""
+        try:
+            flight.image_data = self._render_once(chart_type, profile, image_format, window, data_version,
+                                                  cache_key, render)
+        except Exception as e:
+            logger.error(f"Error rendering {chart_type} chart: {e}")
+        finally:
+            with self.lock:
+                del self.inflight[cache_key]
+            flight.done.set()
+    
+    def _single_flight(self, chart_type: str, profile: str, image_format: str, window: str,
+                       data_version: int, cache_key: str, render: Callable[[], bytes]) -> Optional[bytes]:
+        """Render a key in this thread, or wait for the thread already rendering it."""
+        flight, leader = self._begin_flight(cache_key)
+        if leader:
+            self._run_flight(flight, chart_type, profile, image_format, window, data_version, cache_key, render)
+            return flight.image_data
+        
+        if flight.done.wait(self.render_timeout) and flight.image_data:
+            return flight.image_data
+        logger.warning(f"Timed out waiting for {chart_type} chart render (key: {cache_key}), rendering")
+        return render()
+    
+    def _refresh_async(self, chart_type: str, profile: str, image_format: str, window: str,
+                       data_version: int, cache_key: str, render: Callable[[], bytes]) -> _RenderFlight:
+        """Render a key in a background thread unless it is already being rendered."""
+        flight, leader = self._begin_flight(cache_key)
+        if leader:
+            thread = threading.Thread(target=self._run_flight, name='chart-cache-refresh', daemon=True,
+                                      args=(flight, chart_type, profile, image_format, window, data_version,
+                                            cache_key, render))
+            thread.start()
+        return flight
+    
+    def _render_once(self, chart_type: str, profile: str, image_format: str, window: str,
+                     data_version: int, cache_key: str, render: Callable[[], bytes]) -> bytes:
+        """Render under the shared store's lease, or reuse another worker's result."""
+        leased = self._acquire_lease(cache_key)
+        if not leased:
+            deadline = time.time() + self.render_timeout
+            while time.time() < deadline:
+                time.sleep(0.05)
+                image_data = self.get(chart_type, profile, image_format, window, data_version)
+                if image_data:
+                    with self.lock:
+                        self.coalesced += 1
+                    return image_data
+                leased = self._acquire_lease(cache_key)
+                if leased:
+                    break
+            else:
+                logger.warning(f"Timed out waiting for another worker's {chart_type} chart render, rendering")
+        
+        try:
+            # The previous lease holder may have finished between our last read and taking the lease
+            image_data = self.get(chart_type, profile, image_format, window, data_version)
+            if image_data:
+                return image_data
+            
+            image_data = render()
+            self.set(chart_type, profile, image_format, window, data_version, image_data)
+            return image_data
+        finally:
+            if leased and self.store is not None:
+                try:
+                    self.store.release_lease(cache_key)
+                except Exception as e:
+                    logger.warning(f"Could not release chart render lease: {e}")
+    
+    def _acquire_lease(self, cache_key: str) -> bool:
+        """Take the shared render lease for a key (always succeeds without a shared store)."""
+        if self.store is None:
+            return True
+        try:
+            return self.store.acquire_lease(cache_key, self.render_timeout)
+        except Exception as e:
+            logger.warning(f"Shared chart render lease unavailable, rendering without it: {e}")
+            return True
+    
     def clear_expired(self) -> int:
-        """Remove all expired cache entries. Returns number of entries removed."""
+        """Remove all entries too old to be served stale. Returns number of entries removed."""
         current_time = time.time()
-        expired_keys = [
-            key for key, entry in self.cache.items() 
-            if current_time >= entry['expires_at']
-        ]
-        
-        for key in expired_keys:
-            del self.cache[key]
+        with self.lock:
+            expired_keys = [
+                key for key, entry in self.cache.items() 
+                if current_time >= entry['expires_at'] + self.max_stale
+            ]
+            
+            for key in expired_keys:
+                self._remove(key)
         
         if expired_keys:
             logger.debug(f"Cleared {len(expired_keys)} expired cache entries")
@@ -116,23 +381,49 @@ class ChartCache:
     
     def clear_all(self) -> int:
         """Clear all cache entries. Returns number of entries removed."""
-        count = len(self.cache)
-        self.cache.clear()
+        with self.lock:
+            count = len(self.cache)
+            self.cache.clear()
+            self.total_bytes = 0
+        
+        if self.store is not None:
+            count = max(count, self.store.clear_all())
         logger.info(f"Cleared all {count} cache entries")
         return count
     
     def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics."""
         current_time = time.time()
-        active_entries = sum(1 for entry in self.cache.values() if current_time < entry['expires_at'])
-        expired_entries = len(self.cache) - active_entries
+        with self.lock:
+            active_entries = sum(1 for entry in self.cache.values() if current_time < entry['expires_at'])
+            total_entries = len(self.cache)
+            total_bytes = self.total_bytes
+            evictions = self.evictions
+            coalesced = self.coalesced
+            rendering = len(self.inflight)
+            stale_served = self.stale_served
+            budget_fallbacks = self.budget_fallbacks
         
-        return {
-            'total_entries': len(self.cache),
+        stats = {
+            'total_entries': total_entries,
             'active_entries': active_entries,
-            'expired_entries': expired_entries,
-            'cache_size_mb': sum(len(entry['image_data']) for entry in self.cache.values()) / (1024 * 1024)
+            'expired_entries': total_entries - active_entries,
+            'cache_size_mb': total_bytes / (1024 * 1024),
+            'max_entries': self.max_entries,
+            'max_size_mb': self.max_bytes / (1024 * 1024),
+            'evictions': evictions,
+            'coalesced_renders': coalesced,
+            'renders_in_progress': rendering,
+            'max_stale_seconds': self.max_stale,
+            'stale_served': stale_served,
+            'render_budget_seconds': self.render_budget,
+            'budget_fallbacks': budget_fallbacks
         }
+        
+        if self.store is not None:
+            stats['shared'] = self.store.get_stats()
+        
+        return stats
 
 # Global cache instance
 _chart_cache = None
@@ -141,5 +432,14 @@ def get_chart_cache() -> ChartCache:
     """Get the global chart cache instance."""
     global _chart_cache
     if _chart_cache is None:
-        _chart_cache = ChartCache(default_ttl=300)  # 5 minutes
+        _chart_cache = ChartCache(
+            default_ttl=Config.CHART_CACHE_TTL,
+            max_entries=Config.CHART_CACHE_MAX_ENTRIES,
+            max_bytes=Config.CHART_CACHE_MAX_BYTES,
+            sweep_interval=Config.CHART_CACHE_SWEEP_INTERVAL,
+            store=create_chart_store(Config.CHART_CACHE_BACKEND, Config.CHART_CACHE_PATH),
+            render_timeout=Config.CHART_RENDER_TIMEOUT,
+            max_stale=Config.CHART_CACHE_MAX_STALE,
+            render_budget=Config.CHART_RENDER_BUDGET
+        )
     return _chart_cache
\ No newline at end of file
@@ -1,68 +1,120 @@
 """
-Chart generation module for weather data using matplotlib and seaborn.
+Chart generation module for weather data using matplotlib.
 Generates server-side charts with astronomical background shading.
 """
 
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.collections import PolyCollection
 import matplotlib.dates as mdates
-import seaborn as sns
 import pandas as pd
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
 import io
-import base64
 import logging
+from timezone_utils import CENTRAL_TZ
 from .chart_cache import get_chart_cache
-from timezone_utils import to_central
+from .metrics import SIZE_BUCKETS, get_metrics, timed
 
 logger = logging.getLogger(__name__)
 
-# Set matplotlib and seaborn style
-plt.style.use('default')
-sns.set_palette("husl")
+# Chart style, applied explicitly to each figure rather than through global
+# rcParams so that charts can be rendered concurrently from several threads
+CHART_STYLE = {
+    'figure_dpi': 100,
+    'savefig_dpi': 150,
+    'pad_inches': 0.1,
+    'title_size': 14,
+    'label_size': 12,
+    'tick_size': 10,
+    'legend_size': 10,
+    'grid_alpha': 0.3,
+}
 
-class WeatherChartGenerator:
-    """Generate weather charts with astronomical background shading."""
+# Named render profiles: figure size and font scale relative to the standard chart, and output DPI
+RENDER_PROFILES = {
+    'thumbnail': {'size_scale': 0.5, 'font_scale': 0.7, 'dpi': 100},
+    'standard': {'size_scale': 1.0, 'font_scale': 1.0, 'dpi': 150},
+    'print': {'size_scale': 1.0, 'font_scale': 1.0, 'dpi': 300},
+}
+
+# Supported output formats and their MIME types
+IMAGE_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'webp': 'image/webp',
+}
+
+def prepare_observation_frame(historical_data: Union[List[Dict], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Index observations by Central observation time (naive), oldest first.
     
-    def __init__(self):
-        """Initialize the chart generator."""
-        # Configure matplotlib for better-looking charts
-        plt.rcParams.update({
-            'figure.figsize': (14, 8),
-            'figure.dpi': 100,
-            'savefig.dpi': 150,
-            'savefig.bbox': 'tight',
-            'savefig.pad_inches': 0.1,
-            'font.size': 10,
-            'axes.titlesize': 14,
-            'axes.labelsize': 12,
-            'xtick.labelsize': 10,
-            'ytick.labelsize': 10,
-            'legend.fontsize': 10,
-            'lines.linewidth': 2,
-            'grid.alpha': 0.3
-        })
+    Uses the UTC observed_at column when every row has it, otherwise parses
+    the local date and time strings.
+    """
+    if len(historical_data) == 0:
+        return pd.DataFrame()
     
-    def _prepare_data(self, historical_data: List[Dict]) -> pd.DataFrame:
-        """Convert historical data to pandas DataFrame."""
-        if not historical_data:
-            return pd.DataFrame()
-        
-        # Convert to DataFrame (pre-allocate for performance)
-        df = pd.DataFrame(historical_data)
-        
+    df = pd.DataFrame(historical_data)
+    
+    if 'observed_at' in df and df['observed_at'].notna().all():
+        observed_at = pd.to_datetime(df['observed_at'])
+        df['timestamp'] = observed_at.dt.tz_localize('UTC').dt.tz_convert(CENTRAL_TZ).dt.tz_localize(None)
+    else:
         # Combine date and time fields efficiently (handle microseconds)
         df['timestamp'] = pd.to_datetime(df['date'] + ' ' + df['time'], format='mixed')
-        df = df.set_index('timestamp')
-        df = df.sort_index()
-        
-        # Only log on first chart generation to reduce overhead
-        logger.debug(f"Prepared {len(df)} data points")
+    df = df.set_index('timestamp')
+    df = df.sort_index()
+    
+    logger.debug(f"Prepared {len(df)} data points")
+    
+    return df
+
+class WeatherChartGenerator:
+    """Generate weather charts with astronomical background shading."""
+    
+    def __init__(self, profile: str = 'standard', image_format: str = 'png'):
+        """Initialize the chart generator for a render profile and output format."""
+        if profile not in RENDER_PROFILES:
+            raise ValueError(f"Unknown render profile: {profile}")
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        
+        self.profile = profile
+        self.image_format = image_format
+        
+        settings = RENDER_PROFILES[profile]
+        self.size_scale = settings['size_scale']
+        self.style = dict(CHART_STYLE, savefig_dpi=settings['dpi'])
+        for key in ('title_size', 'label_size', 'tick_size', 'legend_size'):
+            self.style[key] = CHART_STYLE[key] * settings['font_scale']
+    
+    def _create_figure(self, figsize: tuple):
+        """Create a standalone figure and axis, not registered with pyplot."""
+        figsize = (figsize[0] * self.size_scale, figsize[1] * self.size_scale)
+        fig = Figure(figsize=figsize, dpi=self.style['figure_dpi'])
+        ax = fig.subplots()
+        return fig, ax
+    
+    def _style_time_axis(self, ax, title: str, ylabel: str) -> None:
+        """Apply title, labels, grid and time formatting to a chart axis."""
+        ax.set_title(title, fontweight='bold', fontsize=self.style['title_size'])
+        ax.set_ylabel(ylabel, fontsize=self.style['label_size'])
+        ax.set_xlabel('Time (US/Chicago)', fontsize=self.style['label_size'])
+        ax.grid(True, alpha=self.style['grid_alpha'])
         
-        return df
+        # Format x-axis for time display
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+        ax.xaxis.set_major_locator(mdates.HourLocator(interval=2))
+        ax.tick_params(axis='both', labelsize=self.style['tick_size'])
+        ax.tick_params(axis='x', labelrotation=45)
+    
+    @timed('chart_prepare_data_seconds')
+    def _prepare_data(self, historical_data: Union[List[Dict], pd.DataFrame]) -> pd.DataFrame:
+        """Convert historical data to a time-indexed DataFrame; prepared frames are shared as is."""
+        if isinstance(historical_data, pd.DataFrame) and isinstance(historical_data.index, pd.DatetimeIndex):
+            return historical_data
+        return prepare_observation_frame(historical_data)
     
+    @timed('chart_background_seconds')
     def _add_astronomical_background(self, ax, astronomical_zones: List[Dict]):
         """Add astronomical background shading to the chart."""
         if not astronomical_zones:
@@ -77,175 +129,124 @@ class WeatherChartGenerator:
             'night': (0.1, 0.1, 0.44, 0.6)
         }
         
-        # Process zones efficiently with reduced object creation
-        current_zone = None
-        zone_start_time = None
-        
-        for zone_data in astronomical_zones + [None]:
-            zone_type = zone_data['zone'] if zone_data else None
-            
-            if zone_type != current_zone:
-                # Draw the previous zone if it exists
-                if current_zone and zone_start_time:
-                    end_time = zone_data['timestamp'] if zone_data else astronomical_zones[-1]['timestamp']
-                    
-                    # Convert UTC timestamps back to Central time for display
-                    import zoneinfo
-                    start_dt = datetime.fromtimestamp(zone_start_time / 1000, tz=zoneinfo.ZoneInfo('UTC'))
-                    end_dt = datetime.fromtimestamp(end_time / 1000, tz=zoneinfo.ZoneInfo('UTC'))
-                    start_dt = to_central(start_dt).replace(tzinfo=None)
-                    end_dt = to_central(end_dt).replace(tzinfo=None)
-                    
-                    # Only draw non-transparent zones
-                    color = zone_colors.get(current_zone, (0.5, 0.5, 0.5, 0.1))
-                    if color[3] > 0:  # Skip transparent zones
-                        ax.axvspan(start_dt, end_dt, alpha=color[3], color=color[:3], zorder=0)
-                
-                # Start new zone
-                current_zone = zone_type
-                zone_start_time = zone_data['timestamp'] if zone_data else None
+        # Build one full-height rectangle per zone: x in data units, y in axes units
+        vertices = []
+        face_colors = []
+        for zone_data in astronomical_zones:
+            # Only draw non-transparent zones
+            color = zone_colors.get(zone_data['zone'], (0.5, 0.5, 0.5, 0.1))
+            if color[3] > 0:  # Skip transparent zones
+                x0 = mdates.date2num(zone_data['start'])
+                x1 = mdates.date2num(zone_data['end'])
+                vertices.append([(x0, 0), (x0, 1), (x1, 1), (x1, 0)])
+                face_colors.append(color)
+        
+        if vertices:
+            background = PolyCollection(vertices, facecolors=face_colors, linewidths=0,
+                                        transform=ax.get_xaxis_transform(), zorder=0)
+            ax.add_collection(background, autolim=False)
     
     def _calculate_sma(self, data: pd.Series, window: int) -> pd.Series:
         """Calculate Simple Moving Average."""
         return data.rolling(window=window, min_periods=1).mean()
     
-    def generate_temperature_chart(self, historical_data: List[Dict], astronomical_zones: List[Dict]) -> str:
+    def generate_temperature_chart(self, historical_data: Union[List[Dict], pd.DataFrame],
+                                   astronomical_zones: List[Dict]) -> bytes:
         """Generate temperature chart with dew point and sky temperature."""
-        # Check cache first
-        cache = get_chart_cache()
-        cached_image = cache.get('temperature', historical_data, astronomical_zones)
-        if cached_image:
-            return cached_image
-        
         df = self._prepare_data(historical_data)
         if df.empty:
-            return self._generate_no_data_chart("No temperature data available")
+            return self.generate_placeholder_chart("No temperature data available")
         
         # Create figure and axis
-        fig, ax = plt.subplots(figsize=(14, 8))
-        
-        # Add astronomical background
-        self._add_astronomical_background(ax, astronomical_zones)
-        
-        # Plot temperature data
-        sns.lineplot(data=df, x=df.index, y='temperature_f', label='Temperature', 
-                    color='#ff6384', linewidth=2, ax=ax)
-        sns.lineplot(data=df, x=df.index, y='dew_point_f', label='Dew Point', 
-                    color='#4bc0c0', linewidth=2, ax=ax)
-        sns.lineplot(data=df, x=df.index, y='sky_temperature_f', label='Sky Temperature', 
-                    color='#9966ff', linewidth=2, ax=ax)
-        
-        # Customize chart
-        ax.set_title('24-Hour Temperature Trends', fontweight='bold')
-        ax.set_ylabel('Temperature (°F)')
-        ax.set_xlabel('Time (US/Chicago)')
-        ax.legend(loc='upper left')
-        ax.grid(True, alpha=0.3)
-        
-        # Format x-axis for time display
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-        ax.xaxis.set_major_locator(mdates.HourLocator(interval=2))
-        plt.setp(ax.xaxis.get_majorticklabels(), rotation=45)
-        
-        plt.tight_layout()
-        image_data = self._fig_to_base64(fig)
-        
-        # Cache the generated image
-        cache.set('temperature', historical_data, astronomical_zones, image_data)
-        
-        return image_data
+        with get_metrics().timer('chart_plot_seconds', chart='temperature'):
+            fig, ax = self._create_figure(figsize=(14, 8))
+            
+            # Add astronomical background
+            self._add_astronomical_background(ax, astronomical_zones)
+            
+            # Plot temperature data
+            times = df.index.to_numpy()
+            ax.plot(times, df['temperature_f'].to_numpy(), label='Temperature', color='#ff6384', linewidth=2)
+            ax.plot(times, df['dew_point_f'].to_numpy(), label='Dew Point', color='#4bc0c0', linewidth=2)
+            ax.plot(times, df['sky_temperature_f'].to_numpy(), label='Sky Temperature', color='#9966ff', linewidth=2)
+            
+            # Customize chart
+            self._style_time_axis(ax, '24-Hour Temperature Trends', 'Temperature (°F)')
+            ax.legend(loc='upper left', fontsize=self.style['legend_size'])
+            
+            fig.tight_layout()
+        return self._fig_to_image(fig)
     
-    def generate_humidity_chart(self, historical_data: List[Dict], astronomical_zones: List[Dict]) -> str:
+    def generate_humidity_chart(self, historical_data: Union[List[Dict], pd.DataFrame],
+                                astronomical_zones: List[Dict]) -> bytes:
         """Generate humidity chart."""
-        # Check cache first
-        cache = get_chart_cache()
-        cached_image = cache.get('humidity', historical_data, astronomical_zones)
-        if cached_image:
-            return cached_image
-        
         df = self._prepare_data(historical_data)
         if df.empty:
-            return self._generate_no_data_chart("No humidity data available")
+            return self.generate_placeholder_chart("No humidity data available")
         
         # Create figure and axis
-        fig, ax = plt.subplots(figsize=(14, 6))
-        
-        # Add astronomical background
-        self._add_astronomical_background(ax, astronomical_zones)
-        
-        # Plot humidity data with area fill
-        sns.lineplot(data=df, x=df.index, y='humidity_percent', label='Humidity (%)', 
-                    color='#36a2eb', linewidth=2, ax=ax)
-        ax.fill_between(df.index, df['humidity_percent'], alpha=0.3, color='#36a2eb')
-        
-        # Customize chart
-        ax.set_title('24-Hour Humidity Trend', fontweight='bold')
-        ax.set_ylabel('Humidity (%)')
-        ax.set_xlabel('Time (US/Chicago)')
-        ax.set_ylim(0, 100)
-        ax.grid(True, alpha=0.3)
-        
-        # Format x-axis for time display
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-        ax.xaxis.set_major_locator(mdates.HourLocator(interval=2))
-        plt.setp(ax.xaxis.get_majorticklabels(), rotation=45)
-        
-        plt.tight_layout()
-        image_data = self._fig_to_base64(fig)
-        
-        # Cache the generated image
-        cache.set('humidity', historical_data, astronomical_zones, image_data)
-        
-        return image_data
+        with get_metrics().timer('chart_plot_seconds', chart='humidity'):
+            fig, ax = self._create_figure(figsize=(14, 6))
+            
+            # Add astronomical background
+            self._add_astronomical_background(ax, astronomical_zones)
+            
+            # Plot humidity data with area fill
+            times = df.index.to_numpy()
+            humidity = df['humidity_percent'].to_numpy()
+            ax.plot(times, humidity, label='Humidity (%)', color='#36a2eb', linewidth=2)
+            ax.fill_between(times, humidity, alpha=0.3, color='#36a2eb')
+            
+            # Customize chart
+            self._style_time_axis(ax, '24-Hour Humidity Trend', 'Humidity (%)')
+            ax.set_ylim(0, 100)
+            ax.legend(fontsize=self.style['legend_size'])
+            
+            fig.tight_layout()
+        return self._fig_to_image(fig)
     
-    def generate_wind_speed_chart(self, historical_data: List[Dict], astronomical_zones: List[Dict]) -> str:
+    def generate_wind_speed_chart(self, historical_data: Union[List[Dict], pd.DataFrame],
+                                  astronomical_zones: List[Dict]) -> bytes:
         """Generate wind speed chart with SMA."""
-        # Check cache first
-        cache = get_chart_cache()
-        cached_image = cache.get('wind_speed', historical_data, astronomical_zones)
-        if cached_image:
-            return cached_image
-        
         df = self._prepare_data(historical_data)
         if df.empty:
-            return self._generate_no_data_chart("No wind speed data available")
+            return self.generate_placeholder_chart("No wind speed data available")
         
         # Create figure and axis
-        fig, ax = plt.subplots(figsize=(14, 6))
-        
-        # Add astronomical background
-        self._add_astronomical_background(ax, astronomical_zones)
-        
-        # Calculate SMA for last 30 data points
-        sma_30 = self._calculate_sma(df['wind_speed_mph'], 30)
-        
-        # Plot wind speed data
-        sns.lineplot(data=df, x=df.index, y='wind_speed_mph', label='Wind Speed (mph)', 
-                    color='#ff9f40', linewidth=1.5, alpha=0.8, ax=ax)
-        ax.fill_between(df.index, df['wind_speed_mph'], alpha=0.3, color='#ff9f40')
-        sns.lineplot(data=df, x=df.index, y=sma_30, label='SMA 30', 
-                    color='#ff6384', linewidth=2, ax=ax)
-        
-        # Customize chart
-        ax.set_title('24-Hour Wind Speed Trend', fontweight='bold')
-        ax.set_ylabel('Wind Speed (mph)')
-        ax.set_xlabel('Time (US/Chicago)')
-        ax.set_ylim(bottom=0)
-        ax.legend(loc='upper left')
-        ax.grid(True, alpha=0.3)
-        
-        # Format x-axis for time display
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-        ax.xaxis.set_major_locator(mdates.HourLocator(interval=2))
-        plt.setp(ax.xaxis.get_majorticklabels(), rotation=45)
-        
-        plt.tight_layout()
-        image_data = self._fig_to_base64(fig)
-        
-        # Cache the generated image
-        cache.set('wind_speed', historical_data, astronomical_zones, image_data)
-        
-        return image_data
+        with get_metrics().timer('chart_plot_seconds', chart='wind_speed'):
+            fig, ax = self._create_figure(figsize=(14, 6))
+            
+            # Add astronomical background
+            self._add_astronomical_background(ax, astronomical_zones)
+            
+            # Calculate SMA for last 30 data points
+            sma_30 = self._calculate_sma(df['wind_speed_mph'], 30)
+            
+            # Plot wind speed data
+            times = df.index.to_numpy()
+            wind_speed = df['wind_speed_mph'].to_numpy()
+            ax.plot(times, wind_speed, label='Wind Speed (mph)', color='#ff9f40', linewidth=1.5, alpha=0.8)
+            ax.fill_between(times, wind_speed, alpha=0.3, color='#ff9f40')
+            ax.plot(times, sma_30.to_numpy(), label='SMA 30', color='#ff6384', linewidth=2)
+            
+            # Customize chart
+            self._style_time_axis(ax, '24-Hour Wind Speed Trend', 'Wind Speed (mph)')
+            ax.set_ylim(bottom=0)
+            ax.legend(loc='upper left', fontsize=self.style['legend_size'])
+            
+            fig.tight_layout()
+        return self._fig_to_image(fig)
+    
+    def generate_placeholder_chart(self, message: str) -> bytes:
+        """Generate a placeholder chart showing a message, e.g. when no data is available."""
+        fig, ax = self._create_figure(figsize=(12, 6))
+        ax.text(0.5, 0.5, message, ha='center', va='center', fontsize=16, 
+                transform=ax.transAxes, bbox=dict(boxstyle='round', facecolor='lightgray', alpha=0.5))
+        ax.set_xlim(0, 1)
+        ax.set_ylim(0, 1)
+        ax.axis('off')
+        fig.tight_layout()
+        return self._fig_to_image(fig)
     
     def clear_cache(self) -> int:
         """Clear all cached charts."""
@@ -258,31 +259,20 @@ class WeatherChartGenerator:
         cache.clear_expired()  # Clean up expired entries
         return cache.get_stats()
     
-    def _generate_no_data_chart(self, message: str) -> str:
-        """Generate a placeholder chart when no data is available."""
-        fig, ax = plt.subplots(figsize=(12, 6))
-        ax.text(0.5, 0.5, message, ha='center', va='center', fontsize=16, 
-                transform=ax.transAxes, bbox=dict(boxstyle='round', facecolor='lightgray', alpha=0.5))
-        ax.set_xlim(0, 1)
-        ax.set_ylim(0, 1)
-        ax.axis('off')
-        plt.tight_layout()
-        return self._fig_to_base64(fig)
-    
-    def _fig_to_base64(self, fig) -> str:
-        """Convert matplotlib figure to base64 encoded string."""
+    def _fig_to_image(self, fig) -> bytes:
+        """Convert matplotlib figure to image bytes in the configured format."""
         try:
+            metrics = get_metrics()
             buffer = io.BytesIO()
-            fig.savefig(buffer, format='png', bbox_inches='tight', dpi=150)
-            buffer.seek(0)
-            
-            # Convert to base64
-            image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            plt.close(fig)  # Clean up memory
-            buffer.close()
+            with metrics.timer('chart_encode_seconds', image_format=self.image_format, profile=self.profile):
+                fig.savefig(buffer, format=self.image_format, bbox_inches='tight',
+                            pad_inches=self.style['pad_inches'], dpi=self.style['savefig_dpi'])
             
-            return f"data:image/png;base64,{image_base64}"
+            # Figure is not tracked by pyplot, so no close is needed
+            image_data = buffer.getvalue()
+            metrics.observe('chart_image_bytes', len(image_data), buckets=SIZE_BUCKETS,
+                            image_format=self.image_format, profile=self.profile)
+            return image_data
         except Exception as e:
-            logger.error(f"Error converting figure to base64: {e}")
-            plt.close(fig)
-            return ""
\ No newline at end of file
+            logger.error(f"Error converting figure to {self.image_format}: {e}")
+            return b""
@@ -0,0 +1,197 @@
+"""
+Shared chart image stores.
+Backends behind the in-memory ChartCache that every worker process can read,
+so charts are rendered once per deployment and survive worker restarts.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class ChartStore:
+    """Base class for shared chart image stores."""
+
+    name = 'base'
+
+    def get(self, cache_key: str, max_stale: float = 0) -> Optional[Dict[str, Any]]:
+        """Get an entry that expired no more than max_stale seconds ago, or None."""
+        raise NotImplementedError
+
+    def get_latest(self, key_prefix: str) -> Optional[Dict[str, Any]]:
+        """Get the most recently created entry whose key starts with key_prefix, or None."""
+        raise NotImplementedError
+
+    def set(self, cache_key: str, entry: Dict[str, Any]) -> None:
+        """Store an entry, replacing any existing one atomically."""
+        raise NotImplementedError
+
+    def clear_expired(self, max_stale: float = 0) -> int:
+        """Remove entries that expired more than max_stale seconds ago. Returns number of entries removed."""
+        raise NotImplementedError
+
+    def clear_all(self) -> int:
+        """Remove all entries. Returns number of entries removed."""
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store statistics."""
+        raise NotImplementedError
+
+    def acquire_lease(self, cache_key: str, ttl: float) -> bool:
+        """Try to take the render lease for a key. Returns False if another process holds it."""
+        raise NotImplementedError
+
+    def release_lease(self, cache_key: str) -> None:
+        """Release a render lease taken by this process."""
+        raise NotImplementedError
+
+
+class SQLiteChartStore(ChartStore):
+    """Chart images stored as blobs in a SQLite file shared by all workers."""
+
+    name = 'sqlite'
+
+    _ENTRY_COLUMNS = "chart_type, profile, image_format, image_data, created_at, expires_at"
+
+    def __init__(self, path: str):
+        """Initialize the store, creating the database file if needed."""
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chart_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    chart_type TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    image_format TEXT NOT NULL,
+                    image_data BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chart_cache_expires ON chart_cache (expires_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chart_render_leases (
+                    cache_key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection (sqlite3 connections are not shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")  # Readers never block the writer
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, cache_key: str, max_stale: float = 0) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            f"SELECT {self._ENTRY_COLUMNS} FROM chart_cache WHERE cache_key = ? AND expires_at > ?",
+            (cache_key, time.time() - max_stale)
+        ).fetchone()
+        return self._entry(row)
+
+    def get_latest(self, key_prefix: str) -> Optional[Dict[str, Any]]:
+        # Key range scan on the primary key rather than LIKE, which SQLite cannot index here
+        key_end = key_prefix[:-1] + chr(ord(key_prefix[-1]) + 1)
+        row = self._connection().execute(
+            f"SELECT {self._ENTRY_COLUMNS} FROM chart_cache WHERE cache_key >= ? AND cache_key < ? "
+            "ORDER BY created_at DESC LIMIT 1",
+            (key_prefix, key_end)
+        ).fetchone()
+        return self._entry(row)
+
+    def _entry(self, row: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        """Convert a chart_cache row to a cache entry."""
+        if row is None:
+            return None
+
+        return {
+            'chart_type': row[0],
+            'profile': row[1],
+            'image_format': row[2],
+            'image_data': bytes(row[3]),
+            'created_at': row[4],
+            'expires_at': row[5],
+        }
+
+    def set(self, cache_key: str, entry: Dict[str, Any]) -> None:
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chart_cache "
+                "(cache_key, chart_type, profile, image_format, image_data, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cache_key, entry['chart_type'], entry['profile'], entry['image_format'],
+                 sqlite3.Binary(entry['image_data']), entry['created_at'], entry['expires_at'])
+            )
+
+    def clear_expired(self, max_stale: float = 0) -> int:
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM chart_cache WHERE expires_at <= ?",
+                                (time.time() - max_stale,)).rowcount
+
+    def clear_all(self) -> int:
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM chart_cache").rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        count, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(image_data)), 0) FROM chart_cache"
+        ).fetchone()
+        return {
+            'backend': self.name,
+            'render_leases': self._connection().execute("SELECT COUNT(*) FROM chart_render_leases").fetchone()[0],
+            'entries': count,
+            'size_mb': size / (1024 * 1024),
+        }
+
+    def acquire_lease(self, cache_key: str, ttl: float) -> bool:
+        now = time.time()
+        with self._connection() as conn:
+            # A lease left behind by a crashed worker expires instead of blocking renders forever
+            conn.execute("DELETE FROM chart_render_leases WHERE cache_key = ? AND expires_at <= ?", (cache_key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO chart_render_leases (cache_key, owner, expires_at) VALUES (?, ?, ?)",
+                (cache_key, str(os.getpid()), now + ttl)
+            )
+            return cursor.rowcount == 1
+
+    def release_lease(self, cache_key: str) -> None:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM chart_render_leases WHERE cache_key = ? AND owner = ?",
+                         (cache_key, str(os.getpid())))
+
+
+def create_chart_store(backend: str, path: str) -> Optional[ChartStore]:
+    """
+    Create the shared chart store for a backend name.
+
+    Returns None for the 'memory' backend, or if the store cannot be opened,
+    in which case each process falls back to its own in-memory cache.
+    """
+    if backend == 'memory':
+        return None
+    if backend != SQLiteChartStore.name:
+        raise ValueError(f"Unknown chart cache backend '{backend}'. Available: memory, sqlite")
+
+    try:
+        store = SQLiteChartStore(path)
+        logger.info(f"Using shared chart cache at {path}")
+        return store
+    except Exception as e:
+        logger.warning(f"Shared chart cache unavailable at {path}, using in-memory cache only: {e}")
+        return None
@@ -0,0 +1,64 @@
+"""
+Command line tools for the weather module.
+Registered on the weather blueprint, e.g. 'flask weather fetch-iers'.
+"""
+
+import click
+from .routes import weather_bp
+
+@weather_bp.cli.command('fetch-iers')
+@click.option('--data-dir', default=None, help='Directory for the tables (defaults to ASTROPY_IERS_DIR).')
+def fetch_iers(data_dir):
+    """Download IERS-A and leap second tables for offline astropy use."""
+    from .iers import fetch_iers_tables
+    
+    paths = fetch_iers_tables(data_dir)
+    for name, path in paths.items():
+        click.echo(f"Saved {name} table to {path}")
+
+@weather_bp.cli.command('migrate')
+def migrate():
+    """Apply the weather_data migrations that delete or rewrite rows (run once, with the app stopped)."""
+    from .schema import migrate_weather_data
+    
+    result = migrate_weather_data()
+    for row_id, date, time in result['removed_duplicates']:
+        click.echo(f"Removed duplicate observation {date} {time} (id {row_id})")
+    click.echo(f"Removed {len(result['removed_duplicates'])} duplicate observations")
+    if result['rebuilt_ids']:
+        click.echo("Rebuilt weather_data with AUTOINCREMENT ids")
+
+@weather_bp.cli.command('backfill-observed-at')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows updated per transaction.')
+def backfill_observed_at(batch_size):
+    """Add and index the observed_at column if missing, and fill it for existing rows."""
+    from .schema import ensure_observed_at_column
+    
+    count = ensure_observed_at_column(batch_size)
+    click.echo(f"Backfilled observed_at for {count} rows")
+
+@weather_bp.cli.command('rebuild-rollups')
+@click.option('--days-per-batch', default=1, show_default=True, help='Days of observations rolled up per transaction.')
+def rebuild_rollups(days_per_batch):
+    """Rebuild the 1m, 5m and 1h rollup tables from all stored observations."""
+    from .rollups import rebuild_rollups as rebuild
+    from .schema import ensure_rollup_tables
+    
+    ensure_rollup_tables()
+    count = rebuild(days_per_batch)
+    click.echo(f"Wrote {count} rollup rows")
+
+@weather_bp.cli.command('archive')
+@click.option('--older-than-days', default=None, type=int, help='Retention period (defaults to WEATHER_RETENTION_DAYS).')
+@click.option('--chunk-size', default=None, type=int, help='Rows deleted per transaction (defaults to WEATHER_ARCHIVE_CHUNK_SIZE).')
+def archive(older_than_days, chunk_size):
+    """Move observations older than the retention period from weather_data into the archive."""
+    from config import Config
+    from .archive import archive_old_observations
+    
+    days = older_than_days if older_than_days is not None else Config.WEATHER_RETENTION_DAYS
+    if days <= 0:
+        raise click.UsageError("No retention period: set WEATHER_RETENTION_DAYS or pass --older-than-days")
+    
+    count = archive_old_observations(days, chunk_size or Config.WEATHER_ARCHIVE_CHUNK_SIZE)
+    click.echo(f"Archived {count} observations older than {days} days to {Config.WEATHER_ARCHIVE_PATH}")
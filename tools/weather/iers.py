@@ -0,0 +1,119 @@
+"""
+Offline IERS configuration for the astropy solar position backend.
+Pins astropy to local Earth orientation and leap second tables so that
+coordinate transforms never block on a network download.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+IERS_A_FILENAME = 'finals2000A.all'
+LEAP_SECONDS_FILENAME = 'Leap_Second.dat'
+
+_configured = False
+_configure_lock = threading.Lock()
+
+def _table_paths(data_dir: str) -> Dict[str, str]:
+    """Get local paths of the IERS-A and leap second tables."""
+    return {
+        'iers_a': os.path.join(data_dir, IERS_A_FILENAME),
+        'leap_seconds': os.path.join(data_dir, LEAP_SECONDS_FILENAME),
+    }
+
+def configure_iers(data_dir: Optional[str] = None, warm_up: bool = False) -> None:
+    """
+    Pin astropy's IERS configuration for this process.
+
+    In offline mode astropy is not allowed to touch the network. Earth
+    orientation comes from a pre-fetched IERS-A table when one exists in
+    the data directory, otherwise from the IERS-B table bundled with astropy.
+
+    Args:
+        data_dir: Directory holding pre-fetched tables (defaults to Config.ASTROPY_IERS_DIR)
+        warm_up: Run one transform so table loading happens now rather than on the first request
+    """
+    global _configured
+
+    with _configure_lock:
+        if _configured:
+            return
+
+        if Config.ASTROPY_IERS_OFFLINE:
+            from astropy.utils import data as astropy_data
+            from astropy.utils import iers
+
+            paths = _table_paths(data_dir or Config.ASTROPY_IERS_DIR)
+
+            astropy_data.conf.allow_internet = False
+            iers.conf.auto_download = False
+            iers.conf.auto_max_age = None
+            iers.conf.iers_degraded_accuracy = 'ignore'  # Arcsecond-level errors are irrelevant for zones
+
+            if os.path.exists(paths['iers_a']):
+                iers.earth_orientation_table.set(iers.IERS_A.open(paths['iers_a']))
+                logger.info(f"Using local IERS-A table: {paths['iers_a']}")
+            else:
+                iers.earth_orientation_table.set(iers.IERS_B.open())
+                logger.info("No local IERS-A table found, using bundled IERS-B table. "
+                            "Run 'flask weather fetch-iers' to improve accuracy for recent dates.")
+
+            if os.path.exists(paths['leap_seconds']):
+                iers.conf.system_leap_second_file = paths['leap_seconds']
+
+        _configured = True
+
+    if warm_up:
+        import time
+        import numpy as np
+        from .solar_position import AstropySolarPosition
+
+        backend = AstropySolarPosition(Config.OBSERVATORY_LATITUDE, Config.OBSERVATORY_LONGITUDE,
+                                       Config.OBSERVATORY_ELEVATION)
+        backend.altitudes(np.array([time.time()]))
+        logger.info("Astropy IERS tables loaded")
+
+def fetch_iers_tables(data_dir: Optional[str] = None, timeout: int = 60) -> Dict[str, str]:
+    """
+    Download the IERS-A and leap second tables into the data directory.
+
+    Files are validated and then moved into place atomically, so a failed
+    download never replaces a good table.
+
+    Returns:
+        Dictionary of table name to local file path
+    """
+    from astropy.utils import data as astropy_data
+    from astropy.utils import iers
+
+    data_dir = data_dir or Config.ASTROPY_IERS_DIR
+    os.makedirs(data_dir, exist_ok=True)
+    paths = _table_paths(data_dir)
+
+    sources = {
+        'iers_a': (iers.conf.iers_auto_url, iers.IERS_A.open),
+        'leap_seconds': (iers.conf.iers_leap_second_auto_url, iers.LeapSeconds.open),
+    }
+
+    for name, (url, validate) in sources.items():
+        logger.info(f"Downloading {url}")
+        # Offline mode turns astropy's network access off for the process; this is the one place that needs it
+        with astropy_data.conf.set_temp('allow_internet', True):
+            downloaded = astropy_data.download_file(url, cache=False, timeout=timeout)
+        try:
+            validate(downloaded)
+
+            fd, tmp_path = tempfile.mkstemp(dir=data_dir)
+            os.close(fd)
+            shutil.copyfile(downloaded, tmp_path)
+            os.replace(tmp_path, paths[name])
+        finally:
+            os.remove(downloaded)
+
+    return paths
@@ -0,0 +1,198 @@
+"""
+Validation and bulk insertion of weather observations.
+Shared by the single-observation and batch ingest endpoints.
+"""
+
+import json
+import logging
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import func, insert, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from .archive import get_weather_archive
+from .models import WeatherData, db, observed_at_from_strings
+from .rollups import update_rollups
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = [
+    'date', 'time', 'temperature_f', 'humidity_percent', 'dew_point_f',
+    'wind_speed_mph', 'rain_rate_mm_per_hour', 'sky_temperature_f',
+    'sky_condition', 'wind_condition', 'rain_condition',
+    'daylight_condition', 'roof_close_requested', 'alert_condition'
+]
+
+# Value checks per field; all of them are NOT NULL columns
+NUMERIC_FIELDS = [
+    'temperature_f', 'humidity_percent', 'dew_point_f', 'barometer_mb', 'wind_speed_mph',
+    'wind_direction_degrees', 'rain_rate_mm_per_hour', 'sky_temperature_f'
+]
+TEXT_FIELDS = ['date', 'time', 'sky_condition', 'wind_condition', 'rain_condition',
+               'daylight_condition', 'alert_condition']
+
+# Keys per IN (...) lookup, well under SQLite's bound parameter limit
+_LOOKUP_CHUNK = 400
+
+def _json_repr(value: Any) -> str:
+    """Show a received value the way the client sent it, for error messages."""
+    try:
+        return json.dumps(value)[:50]
+    except (TypeError, ValueError):
+        return repr(value)[:50]
+
+def validate_observation(data: Any) -> Dict[str, Any]:
+    """
+    Validate one observation from the station and build its weather_data row.
+
+    Raises:
+        ValueError: With a client-facing message if the observation is invalid
+    """
+    if not data:
+        raise ValueError('No JSON data provided')
+    if not isinstance(data, dict):
+        raise ValueError('Observation must be a JSON object')
+
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            raise ValueError(f'Missing required field: {field}')
+
+    numbers = {}
+    for field in NUMERIC_FIELDS:
+        value = data.get(field, 0.0)  # barometer_mb and wind_direction_degrees are optional
+        # bool is an int subclass, but true/false is never a valid reading
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f'{field} must be a number, got {_json_repr(value)}')
+        numbers[field] = float(value)
+
+    for field in TEXT_FIELDS:
+        if not isinstance(data[field], str):
+            raise ValueError(f'{field} must be a string, got {_json_repr(data[field])}')
+
+    roof_close_requested = data['roof_close_requested']
+    if roof_close_requested not in (True, False):  # 0 and 1 compare equal and are accepted
+        raise ValueError(f'roof_close_requested must be a boolean, got {_json_repr(roof_close_requested)}')
+
+    try:
+        observed_at = observed_at_from_strings(data['date'], data['time'])
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date/time: {data['date']} {data['time']}")
+
+    return {
+        'date': data['date'],
+        'time': data['time'],
+        **numbers,
+        'sky_condition': data['sky_condition'],
+        'wind_condition': data['wind_condition'],
+        'rain_condition': data['rain_condition'],
+        'daylight_condition': data['daylight_condition'],
+        'roof_close_requested': bool(roof_close_requested),
+        'alert_condition': data['alert_condition'],
+        'observed_at': observed_at,
+    }
+
+def _insert_ignoring_duplicates() -> Optional[Any]:
+    """
+    Build a dialect-native INSERT that skips rows whose (date, time) already exists.
+
+    Returns None on databases without one; rows are then inserted one by one.
+    """
+    table = WeatherData.__table__
+    dialect = db.engine.dialect.name
+
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing(index_elements=['date', 'time'])
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        return postgresql_insert(table).on_conflict_do_nothing(index_elements=['date', 'time'])
+    if dialect in ('mysql', 'mariadb'):
+        return insert(table).prefix_with('IGNORE')
+
+    return None
+
+def _insert_each(rows: Sequence[Dict[str, Any]]) -> Dict[Tuple[str, str], int]:
+    """
+    Insert rows one at a time, each in a savepoint, skipping those the unique
+    (date, time) index rejects. Portable fallback for _insert_ignoring_duplicates.
+
+    Returns:
+        Ids of the inserted rows by (date, time)
+    """
+    statement = insert(WeatherData.__table__)
+    inserted = {}
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                result = db.session.execute(statement, row)
+        except IntegrityError:
+            continue
+        inserted[(row['date'], row['time'])] = result.inserted_primary_key[0]
+    return inserted
+
+def insert_observations(rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert validated rows with one bulk statement (row by row on databases without a
+    conflict-skipping INSERT), skipping (date, time) pairs that are already stored or
+    archived, and update the rollup buckets the new rows fall into.
+
+    Runs in the current session transaction; the caller commits.
+
+    Returns:
+        Per-row results in input order: {'status': 'created' | 'duplicate', 'id': row id}
+    """
+    if not rows:
+        return []
+
+    table = WeatherData.__table__
+    statement = _insert_ignoring_duplicates()
+
+    # The unique index only covers weather_data, so replayed observations of archived days are checked here
+    archived = get_weather_archive().find_ids(rows)
+    pending = [row for row in rows if (row['date'], row['time']) not in archived]
+    ids = dict(archived)
+
+    if statement is None:
+        # No conflict-skipping INSERT on this database: a savepoint per row isolates the rejected ones
+        inserted = _insert_each(pending)
+        ids.update(inserted)
+    elif db.engine.dialect.insert_executemany_returning:
+        # RETURNING gives exactly the rows this statement inserted (SQLite 3.35+, PostgreSQL)
+        inserted = set()
+        if pending:
+            result = db.session.execute(statement.returning(table.c.id, table.c.date, table.c.time), pending)
+            for row_id, date, time in result:
+                ids[(date, time)] = row_id
+                inserted.add((date, time))
+    else:
+        # MySQL has no INSERT ... RETURNING: rows with an id above the maximum read
+        # first were inserted here. The read takes no lock, so a concurrent insert of
+        # the same (date, time) committed in between is reported as created too.
+        max_id_before = db.session.execute(select(func.max(table.c.id))).scalar() or 0
+        if pending:
+            db.session.execute(statement, pending)
+        inserted = None
+
+    # Look up the existing ids of skipped rows
+    keys = [key for key in dict.fromkeys((row['date'], row['time']) for row in rows) if key not in ids]
+    for start in range(0, len(keys), _LOOKUP_CHUNK):
+        chunk = keys[start:start + _LOOKUP_CHUNK]
+        for row_id, date, time in db.session.execute(
+            select(table.c.id, table.c.date, table.c.time).where(tuple_(table.c.date, table.c.time).in_(chunk))
+        ):
+            ids[(date, time)] = row_id
+
+    results = []
+    seen = set()
+    for row in rows:
+        key = (row['date'], row['time'])
+        row_id = ids.get(key)
+        if inserted is not None:
+            created = key in inserted and key not in seen
+        else:
+            created = (row_id is not None and row_id > max_id_before and key not in archived
+                       and key not in seen)
+        seen.add(key)
+        results.append({'status': 'created' if created else 'duplicate', 'id': row_id})
+
+    update_rollups(row['observed_at'] for row, result in zip(rows, results) if result['status'] == 'created')
+    return results
@@ -0,0 +1,201 @@
+"""
+Write-behind ingest queue for weather observations.
+Request threads only validate and enqueue; a background writer inserts the
+queued observations in group commits, so a burst from the station costs one
+transaction per group instead of one per observation.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+from flask import Flask, current_app
+from config import Config
+from .ingest import insert_observations
+from .metrics import BATCH_SIZE_BUCKETS, get_metrics
+from .models import db
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class IngestQueue:
+    """Bounded queue of validated observations drained by one background writer."""
+
+    def __init__(self, max_size: int = 10000, max_batch: int = 500, max_latency: float = 1.0):
+        """
+        Initialize the queue.
+
+        Args:
+            max_size: Observations held before new ones are rejected
+            max_batch: Most observations written in one group commit
+            max_latency: Longest an observation waits for its group to fill, in seconds
+        """
+        self.queue: 'queue.Queue[Any]' = queue.Queue(maxsize=max_size)
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.lock = threading.Lock()
+        self.app: Optional[Flask] = None
+        self.writer: Optional[threading.Thread] = None
+
+    def start(self, app: Flask) -> None:
+        """Start the background writer for an app if it is not running yet."""
+        with self.lock:
+            if self.writer is not None:
+                return
+            self.app = app
+            self.writer = threading.Thread(target=self._run, name='weather-ingest-writer', daemon=True)
+            self.writer.start()
+            atexit.register(self.stop)
+
+    def enqueue(self, rows: Sequence[Dict[str, Any]]) -> int:
+        """
+        Queue validated observation rows for writing.
+
+        Returns:
+            Number of rows queued; rows after the first that does not fit are rejected
+        """
+        metrics = get_metrics()
+        queued = 0
+        for row in rows:
+            try:
+                self.queue.put_nowait(row)
+            except queue.Full:
+                metrics.inc('weather_ingest_rejected_total', len(rows) - queued)
+                break
+            queued += 1
+
+        metrics.inc('weather_ingest_enqueued_total', queued)
+        metrics.set_gauge('weather_ingest_queue_depth', self.queue.qsize())
+        return queued
+
+    def depth(self) -> int:
+        """Get the number of observations waiting to be written."""
+        return self.queue.qsize()
+
+    def stop(self, timeout: float = 30) -> None:
+        """Write everything still queued and stop the writer (called at interpreter exit)."""
+        with self.lock:
+            writer = self.writer
+            self.writer = None
+        if writer is None:
+            return
+
+        self.queue.put(_STOP)
+        writer.join(timeout)
+        if writer.is_alive():
+            logger.error(f"Weather ingest writer did not finish within {timeout}s, "
+                         f"{self.queue.qsize()} observations may be lost")
+
+    def _run(self) -> None:
+        """Drain the queue in groups bounded by max_batch and max_latency (runs in the writer thread)."""
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+
+        # Flush whatever arrived before shutdown
+        remaining_rows = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining_rows.append(item)
+        for start in range(0, len(remaining_rows), self.max_batch):
+            self._write(remaining_rows[start:start + self.max_batch], prerender=False)
+
+        logger.info("Weather ingest writer stopped")
+
+    def _write(self, batch: List[Dict[str, Any]], prerender: bool = True) -> None:
+        """
+        Insert one group of observations and commit it, then schedule a chart re-render.
+
+        If the group commit fails, the rows are retried one per transaction,
+        so a row the database rejects is dropped (and logged) on its own
+        instead of taking the rest of its group with it.
+        """
+        from .prerender import schedule_chart_prerender
+
+        metrics = get_metrics()
+        metrics.set_gauge('weather_ingest_queue_depth', self.queue.qsize())
+        metrics.observe('weather_ingest_batch_size', len(batch), buckets=BATCH_SIZE_BUCKETS)
+
+        with self.app.app_context():
+            try:
+                created = self._commit(batch)
+            except Exception as e:
+                # Database errors carry the whole statement; the driver's message is enough here
+                logger.warning(f"Error writing {len(batch)} queued weather observations, "
+                               f"retrying one at a time: {getattr(e, 'orig', e)}")
+                created = 0
+                for row in batch:
+                    try:
+                        created += self._commit([row])
+                    except Exception as e:
+                        metrics.inc('weather_ingest_written_total', 1, result='failed')
+                        logger.error(f"Dropped queued weather observation {row['date']} {row['time']}: "
+                                     f"{getattr(e, 'orig', e)}")
+
+            if created and prerender:
+                schedule_chart_prerender()
+
+        logger.debug(f"Wrote {created} of {len(batch)} queued weather observations")
+
+    def _commit(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Insert rows in one transaction and commit it.
+
+        Returns:
+            Number of rows created
+
+        Raises:
+            Exception: Whatever the insert or commit raised, after rolling back
+        """
+        metrics = get_metrics()
+        try:
+            with metrics.timer('weather_ingest_commit_seconds'):
+                results = insert_observations(rows)
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        created = sum(1 for result in results if result['status'] == 'created')
+        metrics.inc('weather_ingest_written_total', created, result='created')
+        metrics.inc('weather_ingest_written_total', len(rows) - created, result='duplicate')
+        return created
+
+# Global ingest queue instance
+_ingest_queue = None
+
+def get_ingest_queue() -> IngestQueue:
+    """Get the global write-behind ingest queue, starting its writer for the current app."""
+    global _ingest_queue
+    if _ingest_queue is None:
+        _ingest_queue = IngestQueue(max_size=Config.WEATHER_INGEST_QUEUE_SIZE,
+                                    max_batch=Config.WEATHER_INGEST_GROUP_SIZE,
+                                    max_latency=Config.WEATHER_INGEST_GROUP_LATENCY)
+    _ingest_queue.start(current_app._get_current_object())
+    return _ingest_queue
@@ -0,0 +1,200 @@
+"""
+In-process counters, gauges and latency histograms for the weather chart pipeline.
+Exposed as JSON on the admin cache stats endpoint and in the Prometheus text
+format on the metrics endpoint. Values are per worker process.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000)
+
+METRIC_HELP = {
+    'weather_history_query_seconds': 'Time to load the 24-hour observation history from the database',
+    'weather_zones_seconds': 'Time to look up astronomical zone intervals for the history window',
+    'chart_prepare_data_seconds': 'Time to build the chart DataFrame from observations',
+    'chart_background_seconds': 'Time to draw the astronomical zone background',
+    'chart_plot_seconds': 'Time to build a chart figure (background, series, layout), excluding data preparation and encoding',
+    'chart_encode_seconds': 'Time to draw and encode a chart figure (matplotlib draws lazily at save time)',
+    'chart_image_bytes': 'Size of encoded chart images',
+    'chart_render_seconds': 'Total time to render a chart from observations',
+    'chart_cache_get_seconds': 'Time to look up a chart in the memory and shared caches',
+    'chart_cache_set_seconds': 'Time to store a chart in the memory and shared caches',
+    'chart_cache_lookups_total': 'Chart cache lookups by the tier that answered',
+    'chart_cache_requests_total': 'Chart requests by how they were answered',
+    'weather_ingest_queue_depth': 'Observations waiting in the write-behind ingest queue',
+    'weather_ingest_enqueued_total': 'Observations accepted into the write-behind ingest queue',
+    'weather_ingest_rejected_total': 'Observations rejected because the write-behind ingest queue was full',
+    'weather_ingest_written_total': 'Observations written by the write-behind ingest queue, by result',
+    'weather_ingest_batch_size': 'Observations per write-behind group commit',
+    'weather_ingest_commit_seconds': 'Time to insert and commit one write-behind group',
+    'weather_rollup_update_seconds': 'Time to recompute the rollup buckets touched by an ingest',
+    'weather_archive_read_seconds': 'Time to read archived observations for a time range',
+    'weather_archive_rows_total': 'Observations moved from weather_data into the archive',
+    'weather_export_rows_total': 'Observations streamed by the history export, by format',
+}
+
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    """Cumulative-bucket histogram with a running sum and count."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+class MetricsRegistry:
+    """Thread-safe registry of labelled counters, gauges and histograms."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Increment a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge to its current value."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels: str) -> None:
+        """Record a value in a histogram (buckets are fixed by the first observation)."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def counter_total(self, name: str, **labels: str) -> float:
+        """Sum a counter over all series whose labels include the given ones."""
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (series, series_labels), value in self.counters.items()
+                       if series == name and wanted <= set(series_labels))
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Time the enclosed block into a latency histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        """Drop all recorded values."""
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get all metrics as a JSON-serializable dictionary."""
+        with self.lock:
+            counters = {_series_name(name, labels): value for (name, labels), value in sorted(self.counters.items())}
+            gauges = {_series_name(name, labels): value for (name, labels), value in sorted(self.gauges.items())}
+            histograms = {
+                _series_name(name, labels): {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'mean': histogram.sum / histogram.count if histogram.count else None,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            }
+        return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def to_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        described = set()
+
+        def describe(name: str, metric_type: str) -> None:
+            if name not in described:
+                described.add(name)
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                describe(name, 'counter')
+                lines.append(f"{_series_name(name, labels)} {value:g}")
+
+            for (name, labels), value in sorted(self.gauges.items()):
+                describe(name, 'gauge')
+                lines.append(f"{_series_name(name, labels)} {value:g}")
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                describe(name, 'histogram')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                    lines.append(f"{_series_name(name + '_bucket', labels + (('le', le),))} {cumulative}")
+                lines.append(f"{_series_name(name + '_sum', labels)} {histogram.sum:g}")
+                lines.append(f"{_series_name(name + '_count', labels)} {histogram.count}")
+
+        return '\n'.join(lines) + '\n'
+
+def _series_name(name: str, labels: Labels) -> str:
+    """Format a metric name with its labels, e.g. chart_plot_seconds{chart="temperature"}."""
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+# Global metrics instance
+_metrics = None
+
+def get_metrics() -> MetricsRegistry:
+    """Get the global metrics registry."""
+    global _metrics
+    if _metrics is None:
+        _metrics = MetricsRegistry()
+    return _metrics
+
+def timed(name: str) -> Callable:
+    """Decorator that times every call of a function into a latency histogram."""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_metrics().timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,8 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
+from timezone_utils import to_utc
 
 db = SQLAlchemy()
 
+def observed_at_from_strings(date: str, time: str) -> datetime:
+    """
+    Convert an observation's local date and time strings to naive UTC.
+
+    Args:
+        date: Central date as YYYY-MM-DD
+        time: Central time as HH:MM:SS with optional fractional seconds (hour may be unpadded)
+
+    Raises:
+        ValueError: If the date or time cannot be parsed
+    """
+    hour, _, rest = time.partition(':')
+    local = datetime.fromisoformat(f"{date} {hour.zfill(2)}:{rest}")
+    return to_utc(local).replace(tzinfo=None)
+
 class WeatherData(db.Model):
     __tablename__ = 'weather_data'
     
@@ -24,10 +40,14 @@ class WeatherData(db.Model):
     roof_close_requested = db.Column(db.Boolean, nullable=False, default=False)
     alert_condition = db.Column(db.String(50), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    observed_at = db.Column(db.DateTime, index=True)  # Observation time in UTC, derived from date/time
     
-    # Add composite index for efficient date/time queries
+    # One row per observation time; also serves date/time lookups and ingest conflict handling.
+    # Ids are never reused (AUTOINCREMENT on SQLite), so the data version and delta-sync watermarks only grow;
+    # only SQLite also makes them visible in commit order (see service.ids_visible_in_commit_order)
     __table_args__ = (
-        db.Index('idx_date_time', 'date', 'time'),
+        db.Index('uq_weather_date_time', 'date', 'time', unique=True),
+        {'sqlite_autoincrement': True},
     )
     
     def to_dict(self):
@@ -49,5 +69,76 @@ class WeatherData(db.Model):
             'daylight_condition': self.daylight_condition,
             'roof_close_requested': self.roof_close_requested,
             'alert_condition': self.alert_condition,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'observed_at': self.observed_at.isoformat() if self.observed_at else None
+        }
+
+class TwilightNight(db.Model):
+    """Sun altitude crossing times for one local night (noon to noon) at one location."""
+    __tablename__ = 'twilight_nights'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    night_date = db.Column(db.String(10), nullable=False)  # Local date of the evening (YYYY-MM-DD)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    start_zone = db.Column(db.String(30), nullable=False)  # Darkness zone at local noon
+    # Crossing times in UTC; NULL when the sun never crosses that altitude on this night
+    sunset = db.Column(db.DateTime)
+    civil_dusk = db.Column(db.DateTime)
+    nautical_dusk = db.Column(db.DateTime)
+    astronomical_dusk = db.Column(db.DateTime)
+    astronomical_dawn = db.Column(db.DateTime)
+    nautical_dawn = db.Column(db.DateTime)
+    civil_dawn = db.Column(db.DateTime)
+    sunrise = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('night_date', 'latitude', 'longitude', name='uq_twilight_night_location'),
+    )
+
+# Rolled-up observation fields: every numeric field gets min, max, mean and last
+# columns, every condition field holds the condition reported most often
+ROLLUP_NUMERIC_FIELDS = [
+    'temperature_f', 'humidity_percent', 'dew_point_f', 'barometer_mb', 'wind_speed_mph',
+    'wind_direction_degrees', 'rain_rate_mm_per_hour', 'sky_temperature_f'
+]
+ROLLUP_STATS = ['min', 'max', 'mean', 'last']
+ROLLUP_CONDITION_FIELDS = [
+    'sky_condition', 'wind_condition', 'rain_condition', 'daylight_condition', 'alert_condition'
+]
+
+class WeatherRollupMixin:
+    """Columns shared by the downsampled weather_data tables, one row per time bucket."""
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # Bucket start in UTC
+    sample_count = db.Column(db.Integer, nullable=False)  # Raw observations in the bucket
+    last_observed_at = db.Column(db.DateTime, nullable=False)  # UTC time of the bucket's last observation
+    roof_close_requested = db.Column(db.Boolean, nullable=False, default=False)  # Requested at any time in the bucket
+
+for _field in ROLLUP_NUMERIC_FIELDS:
+    for _stat in ROLLUP_STATS:
+        setattr(WeatherRollupMixin, f'{_field}_{_stat}', db.Column(db.Float))
+for _field in ROLLUP_CONDITION_FIELDS:
+    setattr(WeatherRollupMixin, _field, db.Column(db.String(50)))
+
+class WeatherRollup1m(WeatherRollupMixin, db.Model):
+    """One-minute weather rollups, built from weather_data."""
+    __tablename__ = 'weather_rollup_1m'
+    resolution = 60  # seconds
+
+class WeatherRollup5m(WeatherRollupMixin, db.Model):
+    """Five-minute weather rollups, built from the one-minute rollups."""
+    __tablename__ = 'weather_rollup_5m'
+    resolution = 300
+
+class WeatherRollup1h(WeatherRollupMixin, db.Model):
+    """Hourly weather rollups, built from the five-minute rollups."""
+    __tablename__ = 'weather_rollup_1h'
+    resolution = 3600
+
+# Finest first; each resolution is built from the one before it
+ROLLUP_MODELS = {
+    '1m': WeatherRollup1m,
+    '5m': WeatherRollup5m,
+    '1h': WeatherRollup1h,
+}
@@ -0,0 +1,71 @@
+"""
+Background pre-rendering of weather charts.
+New observations schedule a debounced re-render in a worker thread that fills
+the chart cache for the new data version, so chart requests read ready-made
+images instead of rendering inline.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional, Sequence
+from flask import Flask, current_app
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ChartPrerenderer:
+    """Render charts in the background after new weather data arrives."""
+
+    def __init__(self, delay: float = 10.0, profiles: Sequence[str] = ('standard',)):
+        """Initialize with the debounce delay in seconds and the render profiles to pre-render."""
+        self.delay = delay
+        self.profiles = list(profiles)
+        self.lock = threading.Lock()
+        self.timer: Optional[threading.Timer] = None
+
+    def schedule(self, app: Flask) -> None:
+        """
+        Schedule a re-render.
+
+        Calls made while a render is already pending are coalesced into it, so
+        a steady stream of observations renders at most once per delay period.
+        """
+        with self.lock:
+            if self.timer is not None:
+                return
+            self.timer = threading.Timer(self.delay, self._render, args=(app,))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _render(self, app: Flask) -> None:
+        """Render all charts from the current data into the chart cache (runs in the timer thread)."""
+        from .service import refresh_charts
+
+        # Observations arriving from now on schedule a fresh render
+        with self.lock:
+            self.timer = None
+
+        try:
+            start = time.time()
+            with app.app_context():
+                count = refresh_charts(self.profiles)
+            logger.debug(f"Pre-rendered {count} weather charts in {time.time() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Error pre-rendering weather charts: {e}")
+
+# Global prerenderer instance
+_prerenderer = None
+
+def get_chart_prerenderer() -> ChartPrerenderer:
+    """Get the global chart prerenderer instance."""
+    global _prerenderer
+    if _prerenderer is None:
+        _prerenderer = ChartPrerenderer(delay=Config.WEATHER_PRERENDER_DELAY,
+                                        profiles=Config.WEATHER_PRERENDER_PROFILES)
+    return _prerenderer
+
+def schedule_chart_prerender() -> None:
+    """Schedule a background chart render for the current app, if enabled."""
+    if Config.WEATHER_PRERENDER_ENABLED:
+        get_chart_prerenderer().schedule(current_app._get_current_object())
@@ -0,0 +1,246 @@
+"""
+Downsampled weather history at one-minute, five-minute and hourly resolution.
+Rollups are kept current on ingest by recomputing only the buckets that new
+observations fall into: one-minute buckets from weather_data, five-minute
+buckets from the one-minute rollups and hourly buckets from the five-minute
+rollups. Long-range queries read the coarsest rollup that still gives enough
+points instead of scanning raw observations.
+"""
+
+from datetime import datetime, timedelta
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import pandas as pd
+from sqlalchemy import delete, func, insert, select
+from .archive import get_weather_archive
+from .metrics import timed
+from .models import (ROLLUP_CONDITION_FIELDS, ROLLUP_MODELS, ROLLUP_NUMERIC_FIELDS, ROLLUP_STATS,
+                     WeatherData, db)
+
+logger = logging.getLogger(__name__)
+
+# Buckets between two updated spans are recomputed too when the gap is at most
+# this long, so a scattered batch costs a few range queries rather than one per bucket
+_MERGE_GAP = timedelta(hours=1)
+
+Span = Tuple[datetime, datetime]
+
+def _floor(moment: datetime, seconds: int) -> datetime:
+    """Round a naive datetime down to a multiple of seconds since midnight."""
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = (moment - midnight).total_seconds()
+    return midnight + timedelta(seconds=offset - offset % seconds)
+
+def _ceil(moment: datetime, seconds: int) -> datetime:
+    """Round a naive datetime up to a multiple of seconds since midnight."""
+    floored = _floor(moment, seconds)
+    return floored if floored == moment else floored + timedelta(seconds=seconds)
+
+def _merge_spans(spans: Iterable[Span], gap: timedelta = timedelta(0)) -> List[Span]:
+    """Merge [start, end) spans that overlap or are at most gap apart."""
+    merged: List[Span] = []
+    for start, end in sorted(spans):
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _observation_rows(start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Load raw and archived observations in [start, end) shaped like single-sample rollup rows, oldest first."""
+    table = WeatherData.__table__
+    columns = ['observed_at', 'roof_close_requested'] + ROLLUP_NUMERIC_FIELDS + ROLLUP_CONDITION_FIELDS
+    result = db.session.execute(
+        select(*[table.c[name] for name in columns])
+        .where(table.c.observed_at >= start, table.c.observed_at < end)
+        .order_by(table.c.observed_at)
+    )
+    observations = [dict(observation) for observation in result.mappings()]
+
+    archived = get_weather_archive().read(start, end, columns)
+    if not archived.empty:
+        values = {name: archived[name].tolist() for name in columns}
+        values['observed_at'] = [moment.to_pydatetime() for moment in values['observed_at']]
+        observations.extend(dict(zip(columns, row)) for row in zip(*values.values()))
+        observations.sort(key=lambda observation: observation['observed_at'])
+
+    rows = []
+    for observation in observations:
+        row = {
+            'bucket_start': observation['observed_at'],
+            'sample_count': 1,
+            'last_observed_at': observation['observed_at'],
+            'roof_close_requested': bool(observation['roof_close_requested']),
+        }
+        for field in ROLLUP_NUMERIC_FIELDS:
+            for stat in ROLLUP_STATS:
+                row[f'{field}_{stat}'] = observation[field]
+        for field in ROLLUP_CONDITION_FIELDS:
+            row[field] = observation[field]
+        rows.append(row)
+    return rows
+
+def _rollup_rows(model, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Load rollup rows with bucket_start in [start, end), oldest first."""
+    table = model.__table__
+    result = db.session.execute(
+        select(table)
+        .where(table.c.bucket_start >= start, table.c.bucket_start < end)
+        .order_by(table.c.bucket_start)
+    )
+    return [dict(row) for row in result.mappings()]
+
+def _combine(bucket_start: datetime, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine rollup-shaped rows (oldest first) into one bucket.
+
+    Means are weighted by sample count. The dominant condition is the one with
+    the most samples (ties go to the most recent); for rows that are
+    themselves rollups that counts each row's dominant condition for all of
+    its samples, so coarse buckets approximate the mode of the raw conditions.
+    """
+    combined = {
+        'bucket_start': bucket_start,
+        'sample_count': sum(row['sample_count'] for row in rows),
+        'last_observed_at': max(row['last_observed_at'] for row in rows),
+        'roof_close_requested': any(row['roof_close_requested'] for row in rows),
+    }
+
+    for field in ROLLUP_NUMERIC_FIELDS:
+        minimums = [row[f'{field}_min'] for row in rows if row[f'{field}_min'] is not None]
+        maximums = [row[f'{field}_max'] for row in rows if row[f'{field}_max'] is not None]
+        means = [(row[f'{field}_mean'], row['sample_count']) for row in rows if row[f'{field}_mean'] is not None]
+        lasts = [row[f'{field}_last'] for row in rows if row[f'{field}_last'] is not None]
+        weight = sum(count for _, count in means)
+        combined[f'{field}_min'] = min(minimums) if minimums else None
+        combined[f'{field}_max'] = max(maximums) if maximums else None
+        combined[f'{field}_mean'] = sum(mean * count for mean, count in means) / weight if weight else None
+        combined[f'{field}_last'] = lasts[-1] if lasts else None
+
+    for field in ROLLUP_CONDITION_FIELDS:
+        votes: Dict[Any, Tuple[int, datetime]] = {}
+        for row in rows:
+            samples, latest = votes.get(row[field], (0, row['last_observed_at']))
+            votes[row[field]] = (samples + row['sample_count'], max(latest, row['last_observed_at']))
+        combined[field] = max(votes, key=votes.get)
+
+    return combined
+
+def _aggregate(rows: List[Dict[str, Any]], seconds: int) -> List[Dict[str, Any]]:
+    """Combine rollup-shaped rows (oldest first) into buckets of the given length."""
+    buckets: Dict[datetime, List[Dict[str, Any]]] = {}
+    for row in rows:
+        buckets.setdefault(_floor(row['bucket_start'], seconds), []).append(row)
+    return [_combine(bucket_start, members) for bucket_start, members in buckets.items()]
+
+def refresh_rollups(start: datetime, end: datetime) -> int:
+    """
+    Recompute every rollup bucket that overlaps [start, end) (naive UTC).
+
+    Runs in the current session transaction; the caller commits.
+
+    Returns:
+        Number of rollup rows written
+    """
+    written = 0
+    source = None  # weather_data for the finest resolution
+    for model in ROLLUP_MODELS.values():
+        span_start = _floor(start, model.resolution)
+        span_end = _ceil(end, model.resolution)
+
+        if source is None:
+            rows = _aggregate(_observation_rows(span_start, span_end), model.resolution)
+        else:
+            rows = _aggregate(_rollup_rows(source, span_start, span_end), model.resolution)
+
+        table = model.__table__
+        db.session.execute(delete(table).where(table.c.bucket_start >= span_start,
+                                               table.c.bucket_start < span_end))
+        if rows:
+            db.session.execute(insert(table), rows)
+        written += len(rows)
+        source = model
+        start, end = span_start, span_end
+
+    return written
+
+@timed('weather_rollup_update_seconds')
+def update_rollups(observed_times: Iterable[Optional[datetime]]) -> int:
+    """
+    Bring the rollups up to date after observations at these times (naive UTC) were added.
+
+    Runs in the current session transaction; the caller commits.
+
+    Returns:
+        Number of rollup rows written
+    """
+    finest = next(iter(ROLLUP_MODELS.values())).resolution
+    spans = _merge_spans(((_floor(moment, finest), _floor(moment, finest) + timedelta(seconds=finest))
+                          for moment in set(observed_times) if moment is not None), _MERGE_GAP)
+    return sum(refresh_rollups(start, end) for start, end in spans)
+
+def rebuild_rollups(days_per_batch: int = 1) -> int:
+    """
+    Rebuild all rollup tables from weather_data and the archive, committing after each batch of days.
+
+    Returns:
+        Number of rollup rows written
+    """
+    for model in ROLLUP_MODELS.values():
+        db.session.execute(delete(model.__table__))
+    db.session.commit()
+
+    table = WeatherData.__table__
+    bounds = [moment for moment in db.session.execute(
+        select(func.min(table.c.observed_at), func.max(table.c.observed_at))
+    ).one() if moment is not None]
+    archived_days = get_weather_archive().partitions()
+    if archived_days:
+        bounds += [datetime.combine(archived_days[0], datetime.min.time()),
+                   datetime.combine(archived_days[-1], datetime.max.time())]
+    if not bounds:
+        return 0
+    first, last = min(bounds), max(bounds)
+
+    # Day boundaries are hour aligned, so batches never split a rollup bucket
+    written = 0
+    batch_start = _floor(first, 86400)
+    while batch_start <= last:
+        batch_end = batch_start + timedelta(days=days_per_batch)
+        written += refresh_rollups(batch_start, batch_end)
+        db.session.commit()
+        batch_start = batch_end
+
+    logger.info(f"Rebuilt weather rollups: {written} rows from {first} to {last}")
+    return written
+
+def choose_resolution(start: datetime, end: datetime, min_points: int) -> Optional[str]:
+    """
+    Pick the coarsest rollup resolution that gives at least min_points buckets over [start, end).
+
+    Returns:
+        Rollup name such as '5m', or None when only raw observations are fine enough
+    """
+    span_seconds = (end - start).total_seconds()
+    for name, model in reversed(ROLLUP_MODELS.items()):
+        if span_seconds / model.resolution >= min_points:
+            return name
+    return None
+
+def get_rollup_frame(resolution: str, start: datetime, end: datetime) -> pd.DataFrame:
+    """
+    Get rollup rows at one resolution with bucket_start in [start, end) (naive UTC).
+
+    Raises:
+        ValueError: If the resolution is unknown
+    """
+    if resolution not in ROLLUP_MODELS:
+        raise ValueError(f"Unknown rollup resolution: {resolution}")
+
+    table = ROLLUP_MODELS[resolution].__table__
+    result = db.session.execute(
+        select(table)
+        .where(table.c.bucket_start >= start, table.c.bucket_start < end)
+        .order_by(table.c.bucket_start)
+    )
+    return pd.DataFrame(result.all(), columns=list(result.keys()))
@@ -1,12 +1,25 @@
-from flask import Blueprint, jsonify, request, render_template
-from flask_login import login_required
+from flask import (Blueprint, Response, current_app, jsonify, request, render_template, make_response,
+                   stream_with_context, url_for)
+from flask_login import current_user, login_required
+from .ingest import insert_observations, validate_observation
+from .ingest_queue import get_ingest_queue
 from .models import WeatherData, db
-from .astronomy import AstronomyCalculator
-from .chart_generator import WeatherChartGenerator
+from .chart_generator import IMAGE_FORMATS, RENDER_PROFILES, WeatherChartGenerator
+from .metrics import get_metrics
+from .prerender import schedule_chart_prerender
+from .rollups import get_rollup_frame
+from .service import (CHART_TYPES, EXPORT_FORMATS, decode_changes_cursor, decode_history_cursor, frame_to_columns,
+                      frame_to_records, get_24_hour_frame, get_astronomical_zones, get_changes, get_chart_image,
+                      get_data_version, get_history_frame, get_history_page, get_latest_frame, get_observation_frame,
+                      has_recent_observations, ids_visible_in_commit_order, iter_export, parse_fields)
+from config import Config
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import json
 import logging
 import time
 from functools import lru_cache
-from timezone_utils import get_central_now
 
 logger = logging.getLogger(__name__)
 weather_bp = Blueprint('weather', __name__)
@@ -26,7 +39,8 @@ def _get_cached_weather_data():
         return _weather_cache[cache_key]['data']
     
     # Fetch fresh data
-    latest_weather = WeatherData.query.order_by(WeatherData.created_at.desc()).first()
+    latest_weather = (WeatherData.query.filter(WeatherData.observed_at.is_not(None))
+                      .order_by(WeatherData.observed_at.desc(), WeatherData.id.desc()).first())
     
     # Cache the result
     _weather_cache[cache_key] = {
@@ -36,66 +50,58 @@ def _get_cached_weather_data():
     
     return latest_weather
 
+def _projection():
+    """Read the ?fields= projection and ?format= (records or columnar) of a JSON data request"""
+    fields = parse_fields(request.args.get('fields'))
+    data_format = request.args.get('format', 'records')
+    if data_format not in ('records', 'columnar'):
+        raise ValueError(f'Unsupported format: {data_format}')
+    return fields, data_format == 'columnar'
+
+def _serialize_frame(frame, columnar):
+    """Rows of a data frame, newest first, as a list of objects or as {field: [values...]} arrays"""
+    return frame_to_columns(frame) if columnar else frame_to_records(frame)
+
 @weather_bp.route('/status')
 def get_status():
-    """Get weather status page"""
+    """
+    Get weather status page
+    
+    The JSON form accepts ?fields= to project current_weather and
+    historical_data, and ?format=columnar for historical_data arrays.
+    """
     try:
+        wants_json = request.headers.get('Accept') == 'application/json'
         latest_weather = _get_cached_weather_data()
         
+        if not wants_json:
+            # Charts and their darkness shading are loaded by the page from the chart image
+            # endpoints; the page itself only needs to know whether there is recent data
+            return render_template('tools/weather/status.html', 
+                                 current_weather=latest_weather if latest_weather else None,
+                                 historical_data=has_recent_observations(timedelta(hours=24)))
+        
         # Get historical data for last 24 hours based on actual observation time
-        from datetime import timedelta
-        # Use Central time for 24-hour window calculation
-        twenty_four_hours_ago = get_central_now() - timedelta(hours=24)
-        twenty_four_hours_ago = twenty_four_hours_ago.replace(tzinfo=None)  # Make naive for database query
-        current_date = twenty_four_hours_ago.strftime('%Y-%m-%d')
-        current_time = twenty_four_hours_ago.strftime('%H:%M:%S')
-        
-        # Query using date/time fields for accurate 24-hour rolling window
-        historical_data = WeatherData.query.filter(
-            (WeatherData.date > current_date) | 
-            ((WeatherData.date == current_date) & (WeatherData.time >= current_time))
-        ).order_by(WeatherData.date.desc(), WeatherData.time.desc()).all()
-        
-        # Calculate astronomical zones for the time period (with reduced logging)
-        astro_calc = AstronomyCalculator()
-        astronomical_zones = []
-        if historical_data:
-            # Use the actual observation times from date/time fields (keep in Central time)
-            import pandas as pd
-            observation_times = []
-            for data in historical_data:
-                obs_time = pd.to_datetime(f"{data.date} {data.time}", format='mixed')
-                observation_times.append(obs_time)
-            
-            start_time = min(observation_times)
-            end_time = max(observation_times)
-            astronomical_zones = astro_calc.calculate_zones_for_timerange(
-                start_time, end_time, interval_minutes=15  # Reduced frequency for performance
-            )
-            logger.debug(f"Generated {len(astronomical_zones)} astronomical zones")
-        
-        # Generate charts server-side
-        chart_generator = WeatherChartGenerator()
-        historical_data_dicts = [data.to_dict() for data in historical_data]
+        fields, columnar = _projection()
+        data_version = get_data_version()
+        if fields:
+            historical_frame = get_24_hour_frame(list(dict.fromkeys(fields + ['observed_at']))).reindex(columns=fields)
+        else:
+            historical_frame = get_24_hour_frame()
         
-        temperature_chart = chart_generator.generate_temperature_chart(historical_data_dicts, astronomical_zones)
-        humidity_chart = chart_generator.generate_humidity_chart(historical_data_dicts, astronomical_zones)
-        wind_speed_chart = chart_generator.generate_wind_speed_chart(historical_data_dicts, astronomical_zones)
+        # Look up astronomical zone intervals for the time period from the per-night twilight table
+        astronomical_zones = get_astronomical_zones(historical_frame, data_version)
         
-        if request.headers.get('Accept') == 'application/json':
-            return jsonify({
-                'current_weather': latest_weather.to_dict() if latest_weather else {},
-                'historical_data': historical_data_dicts,
-                'astronomical_zones': astronomical_zones
-            })
-        else:
-            return render_template('tools/weather/status.html', 
-                                 current_weather=latest_weather if latest_weather else None,
-                                 historical_data=historical_data_dicts,
-                                 astronomical_zones=astronomical_zones,
-                                 temperature_chart=temperature_chart,
-                                 humidity_chart=humidity_chart,
-                                 wind_speed_chart=wind_speed_chart)
+        current_weather = latest_weather.to_dict() if latest_weather else {}
+        if fields and current_weather:
+            current_weather = {name: current_weather[name] for name in fields}
+        return jsonify({
+            'current_weather': current_weather,
+            'historical_data': _serialize_frame(historical_frame, columnar),
+            'astronomical_zones': astronomical_zones
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting weather status: {e}")
         if request.headers.get('Accept') == 'application/json':
@@ -105,10 +111,37 @@ def get_status():
                                  error=str(e), 
                                  current_weather=None,
                                  historical_data=[],
-                                 astronomical_zones=[],
-                                 temperature_chart="",
-                                 humidity_chart="",
-                                 wind_speed_chart="")
+                                 astronomical_zones=[])
+
+@weather_bp.route('/charts/<chart_type>.<image_format>')
+def get_chart(chart_type, image_format):
+    """Serve a weather chart as a cacheable image (?profile=thumbnail|standard|print)"""
+    if chart_type not in CHART_TYPES:
+        return jsonify({'error': f'Unknown chart type: {chart_type}'}), 404
+    if image_format not in IMAGE_FORMATS:
+        return jsonify({'error': f'Unsupported image format: {image_format}'}), 404
+    
+    profile = request.args.get('profile', 'standard')
+    if profile not in RENDER_PROFILES:
+        return jsonify({'error': f'Unknown render profile: {profile}'}), 400
+    
+    try:
+        image_data, fresh = get_chart_image(chart_type, profile, image_format)
+        if not image_data:
+            return jsonify({'error': 'Chart could not be rendered'}), 500
+        
+        response = make_response(image_data)
+        response.mimetype = IMAGE_FORMATS[image_format]
+        response.set_etag(hashlib.sha256(image_data).hexdigest()[:32])
+        response.cache_control.public = True
+        # Stale images and placeholders must be revalidated as soon as the refresh lands
+        response.cache_control.max_age = Config.WEATHER_CHART_MAX_AGE if fresh else 0
+        
+        # Answers If-None-Match with 304 Not Modified when the chart is unchanged
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error(f"Error serving {chart_type} chart: {e}")
+        return jsonify({'error': str(e)}), 500
 
 @weather_bp.route('/api/weatherdata', methods=['POST'])
 def update_weather_data():
@@ -120,67 +153,35 @@ def update_weather_data():
                 'message': 'Content-Type must be application/json'
             }), 400
         
-        data = request.get_json()
-        
-        if not data:
+        try:
+            row = validate_observation(request.get_json())
+        except ValueError as e:
             return jsonify({
                 'status': 'error',
-                'message': 'No JSON data provided'
+                'message': str(e)
             }), 400
         
-        required_fields = [
-            'date', 'time', 'temperature_f', 'humidity_percent', 'dew_point_f',
-            'wind_speed_mph', 'rain_rate_mm_per_hour', 'sky_temperature_f', 
-            'sky_condition', 'wind_condition', 'rain_condition', 
-            'daylight_condition', 'roof_close_requested', 'alert_condition'
-        ]
-        
-        for field in required_fields:
-            if field not in data:
-                return jsonify({
-                    'status': 'error',
-                    'message': f'Missing required field: {field}'
-                }), 400
+        if Config.WEATHER_INGEST_WRITE_BEHIND:
+            return _enqueue_observations([row])
         
-        # Check if data already exists for this date/time combination
-        existing_data = WeatherData.query.filter_by(
-            date=data['date'],
-            time=data['time']
-        ).first()
+        # Existing date/time combinations are skipped by the insert itself
+        result = insert_observations([row])[0]
+        db.session.commit()
         
-        if existing_data:
+        if result['status'] == 'duplicate':
             return jsonify({
                 'status': 'success',
                 'message': 'Weather data already exists for this date/time',
-                'id': existing_data.id
+                'id': result['id']
             }), 200
         
-        weather_data = WeatherData(
-            date=data['date'],
-            time=data['time'],
-            temperature_f=data['temperature_f'],
-            humidity_percent=data['humidity_percent'],
-            dew_point_f=data['dew_point_f'],
-            barometer_mb=data.get('barometer_mb', 0.0),
-            wind_speed_mph=data['wind_speed_mph'],
-            wind_direction_degrees=data.get('wind_direction_degrees', 0.0),
-            rain_rate_mm_per_hour=data['rain_rate_mm_per_hour'],
-            sky_temperature_f=data['sky_temperature_f'],
-            sky_condition=data['sky_condition'],
-            wind_condition=data['wind_condition'],
-            rain_condition=data['rain_condition'],
-            daylight_condition=data['daylight_condition'],
-            roof_close_requested=data['roof_close_requested'],
-            alert_condition=data['alert_condition']
-        )
-        
-        db.session.add(weather_data)
-        db.session.commit()
+        # Re-render charts in the background so status requests find them ready
+        schedule_chart_prerender()
         
         return jsonify({
             'status': 'success',
             'message': 'Weather data updated successfully',
-            'id': weather_data.id
+            'id': result['id']
         }), 201
         
     except Exception as e:
@@ -191,32 +192,270 @@ def update_weather_data():
             'message': f'Internal server error: {str(e)}'
         }), 500
 
+@weather_bp.route('/api/weatherdata/batch', methods=['POST'])
+def update_weather_data_batch():
+    """API endpoint to receive many observations at once (JSON array or NDJSON), committed together"""
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            observations = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    observations.append(json.loads(line))
+                except ValueError:
+                    observations.append(None)  # Reported as invalid below
+        elif request.is_json:
+            observations = request.get_json()
+            if not isinstance(observations, list):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Expected a JSON array of observations'
+                }), 400
+        else:
+            return jsonify({
+                'status': 'error',
+                'message': 'Content-Type must be application/json or application/x-ndjson'
+            }), 400
+        
+        if len(observations) > Config.WEATHER_INGEST_MAX_BATCH:
+            return jsonify({
+                'status': 'error',
+                'message': f'Batch too large: {len(observations)} observations (max {Config.WEATHER_INGEST_MAX_BATCH})'
+            }), 413
+        
+        results = [None] * len(observations)
+        rows = []
+        row_indexes = []
+        for index, observation in enumerate(observations):
+            try:
+                rows.append(validate_observation(observation))
+                row_indexes.append(index)
+            except ValueError as e:
+                results[index] = {'index': index, 'status': 'invalid', 'message': str(e)}
+        
+        if Config.WEATHER_INGEST_WRITE_BEHIND:
+            return _enqueue_observations(rows, results, row_indexes)
+        
+        # One bulk statement and one commit for the whole batch
+        for index, result in zip(row_indexes, insert_observations(rows)):
+            results[index] = {'index': index, **result}
+        db.session.commit()
+        
+        counts = {status: sum(1 for result in results if result['status'] == status)
+                  for status in ('created', 'duplicate', 'invalid')}
+        if counts['created']:
+            schedule_chart_prerender()
+        
+        return jsonify({
+            'status': 'success',
+            'message': f"Stored {counts['created']} of {len(observations)} observations",
+            **counts,
+            'results': results
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error processing weather data batch: {e}")
+        db.session.rollback()
+        return jsonify({
+            'status': 'error',
+            'message': f'Internal server error: {str(e)}'
+        }), 500
+
+def _enqueue_observations(rows, results=None, row_indexes=()):
+    """Queue validated rows for the write-behind writer and answer 202 Accepted (503 when the queue is full)"""
+    ingest_queue = get_ingest_queue()
+    queued = ingest_queue.enqueue(rows)
+    
+    response = {
+        'status': 'accepted' if queued == len(rows) else 'error',
+        'message': f'Queued {queued} of {len(rows)} observations for writing',
+        'queued': queued,
+        'queue_depth': ingest_queue.depth()
+    }
+    if results is not None:
+        for position, index in enumerate(row_indexes):
+            results[index] = {'index': index, 'status': 'queued' if position < queued else 'rejected'}
+        response['invalid'] = sum(1 for result in results if result['status'] == 'invalid')
+        response['results'] = results
+    
+    return jsonify(response), 202 if queued == len(rows) else 503
+
 @weather_bp.route('/api/latest')
 def api_get_latest_weather():
-    """API endpoint to get latest weather data"""
+    """API endpoint to get latest weather data (?fields= selects columns, ?format=columnar gives arrays)"""
     try:
-        latest_weather = WeatherData.query.order_by(WeatherData.created_at.desc()).first()
+        fields, columnar = _projection()
+        latest_frame = get_latest_frame(fields)
         
-        if not latest_weather:
+        if latest_frame.empty:
             return jsonify({'error': 'No weather data found'}), 404
-            
-        return jsonify(latest_weather.to_dict())
+        
+        if columnar:
+            return jsonify(frame_to_columns(latest_frame))
+        return jsonify(frame_to_records(latest_frame)[0])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting latest weather data: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _parse_observation_time(name):
+    """Parse an ISO 8601 query parameter to naive UTC (times without an offset are taken as UTC)"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name}: {value}')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
 @weather_bp.route('/api/history')
 def api_get_weather_history():
-    """API endpoint to get weather data history"""
+    """
+    API endpoint to get weather data history, newest first
+    
+    Optional start/end bound the observation time (ISO 8601, UTC unless an
+    offset is given). Pages hold at most WEATHER_HISTORY_MAX_PAGE rows; when
+    there are more, the X-Next-Cursor and Link headers give the next page.
+    ?fields= selects columns and ?format=columnar returns {field: [values...]}.
+    """
     try:
         limit = request.args.get('limit', 100, type=int)
-        weather_history = WeatherData.query.order_by(WeatherData.created_at.desc()).limit(limit).all()
+        if limit <= 0:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, Config.WEATHER_HISTORY_MAX_PAGE)
+        
+        start = _parse_observation_time('start')
+        end = _parse_observation_time('end')
+        cursor = request.args.get('cursor')
+        before = decode_history_cursor(cursor) if cursor else None
+        fields, columnar = _projection()
         
-        return jsonify([weather.to_dict() for weather in weather_history])
+        history_frame, next_cursor = get_history_page(start, end, before, limit, fields)
+        
+        response = jsonify(_serialize_frame(history_frame, columnar))
+        if next_cursor:
+            next_url = url_for('.api_get_weather_history', **{**request.args.to_dict(), 'cursor': next_cursor})
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = f'<{next_url}>; rel="next"'
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting weather history: {e}")
         return jsonify({'error': str(e)}), 500
 
+@weather_bp.route('/api/changes')
+def api_get_weather_changes():
+    """
+    API endpoint for delta sync: observations added after ?since=, plus the watermark for the next poll
+    
+    since is the watermark from the previous response (a row id, or an
+    opaque cursor while a first sync is paging) or, for a first sync, an
+    observation time in ISO 8601. At most limit rows
+    (WEATHER_HISTORY_MAX_PAGE at most) are returned, latest first; has_more
+    means the client should poll again straight away. Accepts ?fields= and
+    ?format=columnar like /api/history.
+    
+    watermark_exact is true when id watermarks never skip a row (SQLite).
+    On PostgreSQL and MySQL ids can become visible out of commit order, so
+    it is false and clients should re-sync from a time now and then.
+    """
+    try:
+        since = request.args.get('since')
+        if not since:
+            return jsonify({'error': 'since is required (a watermark id or an ISO 8601 time)'}), 400
+        if since.isdigit():
+            since = int(since)
+        else:
+            try:
+                since = _parse_observation_time('since')
+            except ValueError:
+                since = decode_changes_cursor(since)
+        
+        limit = request.args.get('limit', Config.WEATHER_HISTORY_MAX_PAGE, type=int)
+        if limit <= 0:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, Config.WEATHER_HISTORY_MAX_PAGE)
+        fields, columnar = _projection()
+        
+        changes_frame, watermark, has_more = get_changes(since, limit, fields)
+        
+        return jsonify({
+            'data': _serialize_frame(changes_frame, columnar),
+            'watermark': watermark,
+            'has_more': has_more,
+            'watermark_exact': ids_visible_in_commit_order()
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting weather changes: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@weather_bp.route('/api/export')
+def api_export_weather_history():
+    """
+    API endpoint to stream weather data history, oldest first, as NDJSON or CSV
+    
+    Optional start/end bound the observation time as for /api/history. Rows
+    are written as they are read, so any range can be exported.
+    """
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+        
+        start = _parse_observation_time('start')
+        end = _parse_observation_time('end')
+        
+        # The generator runs after this view returns, inside the request context
+        response = Response(stream_with_context(iter_export(start, end, export_format)),
+                            mimetype=EXPORT_FORMATS[export_format])
+        response.headers['Content-Disposition'] = f'attachment; filename=weather-history.{export_format}'
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error exporting weather history: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@weather_bp.route('/api/rollups')
+def api_get_weather_rollups():
+    """API endpoint to get downsampled weather history for the last N hours"""
+    try:
+        hours = request.args.get('hours', 168, type=float)
+        resolution = request.args.get('resolution')
+        if hours <= 0:
+            return jsonify({'error': 'hours must be positive'}), 400
+        
+        end = datetime.now(timezone.utc).replace(tzinfo=None)
+        start = end - timedelta(hours=hours)
+        
+        # Picks the coarsest rollup with enough points unless a resolution is requested
+        if resolution == 'raw':
+            frame = get_observation_frame(start, end)
+        elif resolution:
+            frame = get_rollup_frame(resolution, start, end)
+        else:
+            resolution, frame = get_history_frame(start, end)
+        
+        return jsonify({
+            'resolution': resolution,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'data': frame_to_records(frame)
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting weather rollups: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @weather_bp.route('/admin/cache/stats')
 @login_required
 def get_cache_stats():
@@ -224,11 +463,38 @@ def get_cache_stats():
     try:
         chart_generator = WeatherChartGenerator()
         stats = chart_generator.get_cache_stats()
+        
+        metrics = get_metrics()
+        requests_total = metrics.counter_total('chart_cache_requests_total')
+        hits = metrics.counter_total('chart_cache_requests_total', result='hit')
+        stats['hit_ratio'] = hits / requests_total if requests_total else None
+        stats['metrics'] = metrics.snapshot()
         return jsonify(stats)
     except Exception as e:
         logger.error(f"Error getting cache stats: {e}")
         return jsonify({'error': str(e)}), 500
 
+@weather_bp.route('/metrics')
+def get_metrics_text():
+    """
+    Chart pipeline metrics for this worker in the Prometheus text format
+    
+    Like the admin cache endpoints it needs a logged-in user. A scraper,
+    which cannot log in, sends 'Authorization: Bearer <WEATHER_METRICS_TOKEN>'
+    instead; a wrong token gets a 401 rather than the login redirect.
+    """
+    authorization = request.headers.get('Authorization', '')
+    token = Config.WEATHER_METRICS_TOKEN
+    if not (token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())):
+        if authorization.startswith('Bearer '):
+            return Response('Invalid metrics token\n', status=401, mimetype='text/plain')
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+    
+    response = make_response(get_metrics().to_prometheus())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
 @weather_bp.route('/admin/cache/clear', methods=['POST'])
 @login_required
 def clear_cache():
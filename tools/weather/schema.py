@@ -0,0 +1,242 @@
+"""
+In-place schema upgrades for the weather tables.
+The app creates tables with db.create_all(), which never alters an existing
+table, so columns and indexes added later are migrated and backfilled here.
+"""
+
+import logging
+from typing import Any, Dict, List, Tuple
+from sqlalchemy import bindparam, func, inspect, select, text
+from .models import ROLLUP_MODELS, TwilightNight, WeatherData, db, observed_at_from_strings
+
+logger = logging.getLogger(__name__)
+
+def upgrade_weather_schema() -> None:
+    """
+    Apply the additive in-place weather table upgrades (run at app startup).
+
+    Migrations that delete or rewrite rows are not run here; they are only
+    checked for, and applied with migrate_weather_data().
+    """
+    ensure_observed_at_column()
+    ensure_rollup_tables()
+    ensure_twilight_table()
+    check_unique_observation_time()
+    check_id_autoincrement()
+
+def migrate_weather_data() -> Dict[str, Any]:
+    """
+    Apply the weather_data migrations that delete or rewrite rows.
+
+    Run once per database from schema_update.py or 'flask weather migrate',
+    with the app stopped.
+
+    Returns:
+        Dictionary with the duplicate rows removed as (id, date, time) tuples
+        and whether weather_data was rebuilt with AUTOINCREMENT ids
+    """
+    return {
+        'removed_duplicates': ensure_unique_observation_time(),
+        'rebuilt_ids': ensure_id_autoincrement(),
+    }
+
+def _needs_id_autoincrement() -> bool:
+    """Whether weather_data is a SQLite table declared without AUTOINCREMENT."""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+
+    with db.engine.connect() as conn:
+        ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'weather_data'")).scalar()
+    return ddl is not None and 'AUTOINCREMENT' not in ddl.upper()
+
+def check_id_autoincrement() -> bool:
+    """Check that weather_data ids are never reused, logging a warning when they can be."""
+    if not _needs_id_autoincrement():
+        return True
+
+    logger.warning("weather_data ids can be reused after deletes (no AUTOINCREMENT), so chart cache versions and "
+                   "delta-sync watermarks can repeat; run 'flask weather migrate' to rebuild the table")
+    return False
+
+def check_unique_observation_time() -> bool:
+    """Check for the unique (date, time) index, logging a warning when it is missing."""
+    inspector = inspect(db.engine)
+    if WeatherData.__tablename__ not in inspector.get_table_names():
+        return True
+
+    indexes = {index['name'] for index in inspector.get_indexes(WeatherData.__tablename__)}
+    if 'uq_weather_date_time' in indexes:
+        return True
+
+    logger.warning("weather_data has no unique (date, time) index, which ingest relies on; "
+                   "run 'flask weather migrate' to remove duplicate observations and add it")
+    return False
+
+def ensure_twilight_table() -> None:
+    """Create the twilight_nights table if missing; nights are computed and stored on first use."""
+    inspector = inspect(db.engine)
+    if TwilightNight.__tablename__ in inspector.get_table_names():
+        return
+
+    db.metadata.create_all(db.engine, tables=[TwilightNight.__table__])
+    logger.info(f"Created table: {TwilightNight.__tablename__}")
+
+def ensure_rollup_tables() -> None:
+    """
+    Create the rollup tables if missing.
+
+    They start empty; 'flask weather rebuild-rollups' fills them from the
+    observations stored so far, after which ingest keeps them current.
+    """
+    inspector = inspect(db.engine)
+    existing = set(inspector.get_table_names())
+    missing = [model.__table__ for model in ROLLUP_MODELS.values() if model.__tablename__ not in existing]
+    if not missing:
+        return
+
+    db.metadata.create_all(db.engine, tables=missing)
+    logger.info(f"Created rollup tables: {', '.join(table.name for table in missing)}")
+    if WeatherData.__tablename__ in existing:
+        logger.warning("Rollup tables are empty; run 'flask weather rebuild-rollups' to build them from existing observations")
+
+def ensure_id_autoincrement() -> bool:
+    """
+    Rebuild a SQLite weather_data table without AUTOINCREMENT so that ids are never reused.
+
+    Without AUTOINCREMENT SQLite hands out max(id) + 1, so deleting the newest
+    rows, or archiving every row, gives old ids to new observations. The data
+    version and delta-sync watermarks rely on ids only growing. The id
+    sequence is started above every id in the table and in the archive.
+    Other databases use sequences, which never reuse ids.
+
+    Returns:
+        True if the table was rebuilt
+    """
+    if not _needs_id_autoincrement():
+        return False
+
+    from .archive import get_weather_archive
+
+    inspector = inspect(db.engine)
+
+    logger.info("Rebuilding weather_data with AUTOINCREMENT ids")
+    table = WeatherData.__table__
+    indexes = [index['name'] for index in inspector.get_indexes(WeatherData.__tablename__)]
+    columns = ', '.join(column['name'] for column in inspector.get_columns(WeatherData.__tablename__)
+                        if column['name'] in table.c)
+    with db.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE weather_data RENAME TO weather_data_old"))
+        for name in indexes:
+            conn.execute(text(f"DROP INDEX {name}"))
+        table.create(conn)
+        conn.execute(text(f"INSERT INTO weather_data ({columns}) SELECT {columns} FROM weather_data_old"))
+        conn.execute(text("DROP TABLE weather_data_old"))
+
+        highest = max(conn.execute(select(func.max(table.c.id))).scalar() or 0, get_weather_archive().max_id())
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'weather_data'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('weather_data', :seq)"),
+                     {'seq': highest})
+
+    logger.info(f"Rebuilt weather_data with AUTOINCREMENT ids (next id above {highest})")
+    return True
+
+def ensure_unique_observation_time() -> List[Tuple[int, str, str]]:
+    """
+    Replace the plain (date, time) index with a unique one, which bulk ingest relies on.
+
+    Duplicate observations (same date and time) are removed first, keeping the
+    earliest stored row.
+
+    Returns:
+        The removed rows as (id, date, time)
+    """
+    inspector = inspect(db.engine)
+    if WeatherData.__tablename__ not in inspector.get_table_names():
+        return []
+
+    indexes = {index['name'] for index in inspector.get_indexes(WeatherData.__tablename__)}
+    if 'uq_weather_date_time' in indexes:
+        return []
+
+    duplicates_query = (
+        "FROM weather_data WHERE id NOT IN "
+        "(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM weather_data GROUP BY date, time) AS keep)"
+    )
+    with db.engine.begin() as conn:
+        removed = [tuple(row) for row in conn.execute(text(f"SELECT id, date, time {duplicates_query} ORDER BY id"))]
+        if removed:
+            conn.execute(text(f"DELETE {duplicates_query}"))
+        conn.execute(text("CREATE UNIQUE INDEX uq_weather_date_time ON weather_data (date, time)"))
+        if 'idx_date_time' in indexes:
+            conn.execute(text("DROP INDEX idx_date_time" if db.engine.dialect.name != 'mysql'
+                              else "DROP INDEX idx_date_time ON weather_data"))
+
+    if removed:
+        logger.warning(f"Removed {len(removed)} duplicate weather_data rows before adding unique (date, time) index")
+    logger.info("Added unique (date, time) index to weather_data")
+    return removed
+
+def ensure_observed_at_column(batch_size: int = 5000) -> int:
+    """
+    Add the indexed observed_at column to weather_data if missing, and backfill it.
+
+    Safe to run repeatedly: only rows with no observed_at are updated.
+
+    Args:
+        batch_size: Rows updated per transaction
+
+    Returns:
+        Number of rows backfilled
+    """
+    inspector = inspect(db.engine)
+    if WeatherData.__tablename__ not in inspector.get_table_names():
+        return 0  # db.create_all() will create the table with the column
+
+    table = WeatherData.__table__
+    columns = {column['name'] for column in inspector.get_columns(WeatherData.__tablename__)}
+    if 'observed_at' not in columns:
+        logger.info("Adding observed_at column to weather_data")
+        # DATETIME on SQLite and MySQL, TIMESTAMP WITHOUT TIME ZONE on PostgreSQL
+        column_type = table.c.observed_at.type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE weather_data ADD COLUMN observed_at {column_type}"))
+
+    index = next(index for index in table.indexes if index.name == 'ix_weather_data_observed_at')
+    with db.engine.begin() as conn:
+        index.create(conn, checkfirst=True)
+
+    return backfill_observed_at(batch_size)
+
+def backfill_observed_at(batch_size: int = 5000) -> int:
+    """Fill observed_at from the date and time strings for rows that lack it. Returns rows updated."""
+    table = WeatherData.__table__
+    update = table.update().where(table.c.id == bindparam('row_id')).values(observed_at=bindparam('value'))
+    total = 0
+    last_id = 0
+
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.date, table.c.time)
+                .where(table.c.observed_at.is_(None), table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            values = []
+            for row_id, date, time in rows:
+                try:
+                    values.append({'row_id': row_id, 'value': observed_at_from_strings(date, time)})
+                except ValueError:
+                    logger.warning(f"Cannot parse observation time '{date} {time}' of weather_data row {row_id}")
+            if values:
+                conn.execute(update, values)
+
+        total += len(values)
+        last_id = rows[-1][0]
+
+    if total:
+        logger.info(f"Backfilled observed_at for {total} weather_data rows")
+    return total
@@ -0,0 +1,527 @@
+"""
+Weather data access and chart rendering shared by routes and background workers.
+"""
+
+import base64
+import csv
+from datetime import datetime, timedelta, timezone
+import heapq
+import io
+from itertools import islice
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import numpy as np
+import pandas as pd
+from flask import current_app
+from sqlalchemy import and_, func, or_, select
+from .models import WeatherData, db
+from .chart_cache import get_chart_cache
+from .chart_generator import WeatherChartGenerator, prepare_observation_frame
+from .archive import get_weather_archive
+from .metrics import get_metrics, timed
+from .rollups import choose_resolution, get_rollup_frame
+from .twilight import get_twilight_table
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CHART_TYPES = ['temperature', 'humidity', 'wind_speed']
+HISTORY_WINDOW = '24h'
+
+# Columns the charts read; the JSON history needs every column
+CHART_COLUMNS = ['observed_at', 'temperature_f', 'dew_point_f', 'sky_temperature_f',
+                 'humidity_percent', 'wind_speed_mph']
+
+# Fields clients may select with ?fields=, in WeatherData.to_dict() order
+WEATHER_FIELDS = list(WeatherData.__table__.c.keys())
+
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_CHUNK_ROWS = 1000  # rows fetched, and written to the response, at a time
+
+# Zone intervals per (window, data version): {key: (expires_at, zones)}
+_zones_cache: Dict[Tuple[str, int], Tuple[float, List[Dict]]] = {}
+_zones_lock = threading.Lock()
+
+def get_data_version() -> int:
+    """
+    Get the current weather data version.
+
+    This is the highest observation id, so every committed ingest bumps it
+    (including rows backfilled into the middle of a window) and every worker
+    process sees the same value. Ids are never reused once 'flask weather
+    migrate' has run (see schema.ensure_id_autoincrement), so a version is
+    never handed out again for different data. Returns 0 when there is no data.
+
+    Every commit changes the version only where ids become visible in commit
+    order (SQLite, see ids_visible_in_commit_order). On PostgreSQL and MySQL
+    a row committed after a higher id leaves the version unchanged, so cached
+    charts miss it until the next observation is stored.
+    """
+    return db.session.query(func.max(WeatherData.id)).scalar() or 0
+
+def ids_visible_in_commit_order() -> bool:
+    """
+    Whether weather_data ids become visible in the order they were handed out.
+
+    SQLite has one writer at a time, so a row is never committed after a row
+    with a higher id. PostgreSQL and MySQL take ids from a sequence when the
+    row is inserted, so a slow transaction can commit a lower id after a
+    higher one has already been read.
+    """
+    return db.engine.dialect.name == 'sqlite'
+
+@timed('weather_history_query_seconds')
+def get_24_hour_frame(columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Get observations from the last 24 hours based on actual observation time.
+
+    Selects plain column values with a Core query straight into one DataFrame,
+    without building ORM objects or per-row dicts.
+
+    Args:
+        columns: WeatherData column names to load (defaults to all columns)
+
+    Returns:
+        DataFrame indexed by observation time (Central, naive), oldest first
+    """
+    # observed_at is naive UTC
+    twenty_four_hours_ago = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=24)
+    return get_observation_frame(twenty_four_hours_ago, None, columns)
+
+def has_recent_observations(period: timedelta) -> bool:
+    """
+    Check whether any observation was made within the given period before now.
+
+    One observed_at index probe. Only weather_data is checked: the archive
+    holds whole days older than the retention period, never recent rows.
+    """
+    table = WeatherData.__table__
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - period
+    return db.session.execute(select(table.c.id).where(table.c.observed_at >= since).limit(1)).first() is not None
+
+def get_observation_frame(start: datetime, end: Optional[datetime] = None,
+                          columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Get raw observations with observed_at in [start, end) (naive UTC; no end bound when end is None).
+
+    Reads weather_data and, for days that have been moved out of it, the archive.
+
+    Returns:
+        DataFrame indexed by observation time (Central, naive), oldest first
+    """
+    table = WeatherData.__table__
+    selected = [table.c[name] for name in columns] if columns else list(table.c)
+
+    # Index range scan on observed_at
+    query = select(*selected).where(table.c.observed_at >= start).order_by(table.c.observed_at)
+    if end is not None:
+        query = query.where(table.c.observed_at < end)
+    result = db.session.execute(query)
+    frame = pd.DataFrame(result.all(), columns=list(result.keys()))
+
+    archived = get_weather_archive().read(start, end, columns)
+    if not archived.empty:
+        frame = pd.concat([archived, frame], ignore_index=True) if not frame.empty else archived
+    return prepare_observation_frame(frame)
+
+def get_history_frame(start: datetime, end: datetime, min_points: Optional[int] = None) -> Tuple[str, pd.DataFrame]:
+    """
+    Get weather history for [start, end) (naive UTC) at the coarsest resolution that gives enough points.
+
+    Args:
+        min_points: Fewest buckets a rollup must give over the range (defaults to WEATHER_ROLLUP_MIN_POINTS)
+
+    Returns:
+        Tuple of (resolution, frame): 'raw' with observations as from get_observation_frame,
+        or a rollup name such as '1h' with rollup rows oldest first
+    """
+    resolution = choose_resolution(start, end, min_points or Config.WEATHER_ROLLUP_MIN_POINTS)
+    if resolution is None:
+        return 'raw', get_observation_frame(start, end)
+    return resolution, get_rollup_frame(resolution, start, end)
+
+def _encode_cursor(key: Dict[str, Any]) -> str:
+    """Encode a keyset position as an opaque URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Decode a cursor made by _encode_cursor (raises ValueError if it is malformed)."""
+    key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if not isinstance(key, dict):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key
+
+def encode_history_cursor(observed_at: datetime, row_id: int) -> str:
+    """Encode the (observed_at, id) key of the last row on a history page as an opaque cursor."""
+    return _encode_cursor({'t': observed_at.isoformat(), 'id': row_id})
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a history cursor back to its (observed_at, id) key.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        key = _decode_cursor(cursor)
+        return datetime.fromisoformat(key['t']), int(key['id'])
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def encode_changes_cursor(observed_at: datetime, row_id: int, start_id: int) -> str:
+    """
+    Encode a first-sync position for /api/changes as an opaque watermark.
+
+    Holds the (observed_at, id) key of the last row returned and the highest
+    id when the first sync started, which becomes the id watermark at the end.
+    """
+    return _encode_cursor({'t': observed_at.isoformat(), 'id': row_id, 'start': start_id})
+
+def decode_changes_cursor(cursor: str) -> Tuple[datetime, int, int]:
+    """
+    Decode a first-sync watermark back to (observed_at, id, start id).
+
+    Raises:
+        ValueError: If the watermark is malformed
+    """
+    try:
+        key = _decode_cursor(cursor)
+        return datetime.fromisoformat(key['t']), int(key['id']), int(key['start'])
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"Invalid watermark: {cursor}") from e
+
+def parse_fields(value: Optional[str]) -> Optional[List[str]]:
+    """
+    Parse a comma-separated ?fields= projection.
+
+    Returns:
+        Field names in the order given, or None for all fields when value is empty
+
+    Raises:
+        ValueError: If a field is not a WeatherData column
+    """
+    if not value:
+        return None
+
+    fields = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in WEATHER_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or None
+
+def get_latest_frame(fields: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Get the most recent observation as a one-row frame (empty when there is none), selecting only the given fields."""
+    table = WeatherData.__table__
+    selected = [table.c[name] for name in fields] if fields else list(table.c)
+    # Rows whose time could not be parsed have no observed_at; PostgreSQL would sort them first
+    query = select(*selected).where(table.c.observed_at.is_not(None))
+    result = db.session.execute(query.order_by(table.c.observed_at.desc(), table.c.id.desc()).limit(1))
+    return pd.DataFrame(result.all(), columns=list(result.keys()))
+
+def get_history_page(start: Optional[datetime], end: Optional[datetime], before: Optional[Tuple[datetime, int]],
+                     limit: int, fields: Optional[Sequence[str]] = None) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Get one page of observations by keyset pagination on (observed_at, id), newest first.
+
+    Each page is an index range scan on observed_at that starts at the
+    cursor, and archived days are binary searched the same way, so a page
+    costs the same however far back it is.
+
+    Args:
+        start: Oldest observed_at to include (naive UTC), or None
+        end: observed_at to stop before (naive UTC), or None
+        before: Key decoded from the previous page's cursor, or None for the first page
+        limit: Page size
+        fields: Columns to select (defaults to all columns)
+
+    Returns:
+        Tuple of (frame of the page's rows, oldest first, with only the given fields;
+        cursor for the next page or None on the last page)
+    """
+    table = WeatherData.__table__
+    # The cursor needs the key columns whether or not they were asked for
+    columns = list(dict.fromkeys(list(fields) + ['observed_at', 'id'])) if fields else WEATHER_FIELDS
+    query = select(*[table.c[name] for name in columns]).where(table.c.observed_at.is_not(None))
+    if start is not None:
+        query = query.where(table.c.observed_at >= start)
+    if end is not None:
+        query = query.where(table.c.observed_at < end)
+    if before is not None:
+        # The first term bounds the index range scan, the second breaks ties at the cursor time
+        query = query.where(table.c.observed_at <= before[0],
+                            or_(table.c.observed_at < before[0], and_(table.c.observed_at == before[0],
+                                                                       table.c.id < before[1])))
+
+    # One extra row tells whether there is a next page
+    result = db.session.execute(query.order_by(table.c.observed_at.desc(), table.c.id.desc()).limit(limit + 1))
+    frame = pd.DataFrame(result.all(), columns=list(result.keys()))
+
+    # Archived days are older than anything left in the table, unless late observations arrived for them
+    archive = get_weather_archive()
+    archived_days = archive.partitions()
+    if archived_days and (len(frame) <= limit or
+                          frame['observed_at'].iloc[-1] < datetime.combine(archived_days[-1], datetime.max.time())):
+        archived = archive.read_page(start, end, before, limit + 1, columns)
+        if not archived.empty:
+            frame = pd.concat([frame, archived], ignore_index=True) if not frame.empty else archived
+            frame = frame.sort_values(['observed_at', 'id'], ascending=False).head(limit + 1)
+
+    next_cursor = None
+    if len(frame) > limit:
+        frame = frame.head(limit)
+        last = frame.iloc[-1]
+        next_cursor = encode_history_cursor(pd.Timestamp(last['observed_at']).to_pydatetime(), int(last['id']))
+
+    return frame.iloc[::-1][list(fields) if fields else WEATHER_FIELDS], next_cursor
+
+def get_changes(since: Union[int, datetime, Tuple[datetime, int, int]], limit: int,
+                fields: Optional[Sequence[str]] = None) -> Tuple[pd.DataFrame, Union[int, str], bool]:
+    """
+    Get observations added after a delta-sync watermark.
+
+    An id watermark selects rows with a higher id by a primary key range
+    scan. Ids grow with every insert and are never reused, so this also picks
+    up late observations stored for earlier times, and a poll with nothing
+    new is one index probe. No row is ever missed only where ids become
+    visible in commit order (SQLite, see ids_visible_in_commit_order); on
+    PostgreSQL and MySQL a row whose insert commits after a higher id was
+    returned is skipped, so clients there should re-sync from a time now
+    and then.
+
+    A timestamp (naive UTC) starts a client's first sync: rows observed after
+    it are returned by an observed_at range scan, paged on (observed_at, id)
+    so rows sharing a timestamp are never split across a page cut and lost.
+    While more rows are waiting the watermark is an opaque first-sync cursor;
+    the last page answers with the highest id seen when the sync started, so
+    rows stored meanwhile are returned by the following id polls (rows
+    returned twice that way can be told apart by id).
+
+    Args:
+        since: Watermark from the previous response (an id, or a decoded first-sync
+               cursor), or an observation time to start from
+        limit: Most rows to return
+        fields: Columns to select (defaults to all columns)
+
+    Returns:
+        Tuple of (frame of new rows, oldest first, with only the given fields;
+        watermark for the next request; whether more rows are waiting)
+    """
+    table = WeatherData.__table__
+    columns = list(dict.fromkeys(list(fields) + ['id', 'observed_at'])) if fields else WEATHER_FIELDS
+    query = select(*[table.c[name] for name in columns])
+
+    by_time = not isinstance(since, int)
+    if isinstance(since, datetime):
+        # Read before the rows, so rows inserted meanwhile are returned again rather than skipped
+        start_id = get_data_version()
+        query = query.where(table.c.observed_at > since)
+    elif by_time:
+        after, after_id, start_id = since
+        # The first term bounds the index range scan, the second breaks ties at the watermark time
+        query = query.where(table.c.observed_at >= after,
+                            or_(table.c.observed_at > after, and_(table.c.observed_at == after,
+                                                                  table.c.id > after_id)))
+    else:
+        query = query.where(table.c.id > since)
+    query = query.order_by(table.c.observed_at, table.c.id) if by_time else query.order_by(table.c.id)
+
+    # One extra row tells whether more are waiting
+    result = db.session.execute(query.limit(limit + 1))
+    frame = pd.DataFrame(result.all(), columns=list(result.keys()))
+    has_more = len(frame) > limit
+    frame = frame.head(limit)
+
+    if by_time and has_more:
+        last = frame.iloc[-1]
+        watermark = encode_changes_cursor(pd.Timestamp(last['observed_at']).to_pydatetime(), int(last['id']),
+                                          start_id)
+    elif by_time:
+        watermark = start_id
+    else:
+        watermark = int(frame['id'].iloc[-1]) if not frame.empty else since
+
+    return frame[list(fields) if fields else WEATHER_FIELDS], watermark, has_more
+
+def iter_observation_rows(start: Optional[datetime], end: Optional[datetime],
+                          chunk_size: int = EXPORT_CHUNK_ROWS) -> Iterator[Tuple[Any, ...]]:
+    """
+    Stream observations with observed_at in [start, end) (naive UTC), oldest first.
+
+    The table is read with yield_per, so only chunk_size rows are buffered
+    at a time, and merged lazily with the archive in (observed_at, id) order.
+
+    Yields:
+        Tuples of native Python values in weather_data column order
+    """
+    table = WeatherData.__table__
+    query = select(table).where(table.c.observed_at.is_not(None))
+    if start is not None:
+        query = query.where(table.c.observed_at >= start)
+    if end is not None:
+        query = query.where(table.c.observed_at < end)
+    live = db.session.execute(query.order_by(table.c.observed_at, table.c.id).execution_options(yield_per=chunk_size))
+    archived = get_weather_archive().iter_rows(start, end, chunk_size)
+
+    names = list(table.c.keys())
+    observed_at, row_id = names.index('observed_at'), names.index('id')
+    return heapq.merge(archived, live, key=lambda row: (row[observed_at], row[row_id]))
+
+def iter_export(start: Optional[datetime], end: Optional[datetime], export_format: str = 'ndjson') -> Iterator[str]:
+    """
+    Stream observations as NDJSON (one to_dict() style object per line) or CSV (with a header row).
+
+    Memory use is bounded by EXPORT_CHUNK_ROWS whatever the range size.
+
+    Raises:
+        ValueError: If the format is not in EXPORT_FORMATS
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    names = list(WeatherData.__table__.c.keys())
+    rows = iter_observation_rows(start, end)
+    metrics = get_metrics()
+
+    def generate() -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if export_format == 'csv':
+            writer.writerow(names)
+            yield buffer.getvalue()  # First bytes before any row is read
+
+        while True:
+            chunk = list(islice(rows, EXPORT_CHUNK_ROWS))
+            if not chunk:
+                break
+
+            buffer.seek(0)
+            buffer.truncate()
+            for row in chunk:
+                values = [value.isoformat() if isinstance(value, datetime) else value for value in row]
+                if export_format == 'csv':
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(names, values))))
+                    buffer.write('\n')
+            metrics.inc('weather_export_rows_total', len(chunk), format=export_format)
+            yield buffer.getvalue()
+
+    return generate()
+
+def frame_to_columns(frame: pd.DataFrame) -> Dict[str, List[Any]]:
+    """Convert a history or rollup frame to {field: [values...]} arrays of JSON-ready values, newest first."""
+    newest_first = frame.iloc[::-1]
+    columns = {name: newest_first[name].tolist() for name in newest_first.columns}  # Native Python values
+    for name in newest_first.columns:
+        if pd.api.types.is_datetime64_any_dtype(newest_first[name]):
+            iso = np.datetime_as_string(newest_first[name].to_numpy(dtype='datetime64[us]'), unit='us')
+            # Match datetime.isoformat(), which drops the fraction when there are no microseconds
+            columns[name] = [None if value == 'NaT' else value[:-7] if value.endswith('.000000') else value
+                             for value in iso.tolist()]
+    return columns
+
+def frame_to_records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert a history or rollup frame to WeatherData.to_dict() style records, newest first."""
+    if frame.empty:
+        return []
+
+    columns = frame_to_columns(frame)
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+def get_astronomical_zones(historical_frame: pd.DataFrame, data_version: Optional[int] = None) -> List[Dict]:
+    """
+    Look up darkness zone intervals covering the observations.
+
+    Args:
+        historical_frame: Observations from the history window, as returned by get_24_hour_frame
+        data_version: Data version the observations were read at; results are cached per version when given
+    """
+    if historical_frame.empty:
+        return []
+
+    cache_key = (HISTORY_WINDOW, data_version)
+    if data_version is not None:
+        with _zones_lock:
+            cached = _zones_cache.get(cache_key)
+        if cached is not None and time.time() < cached[0]:
+            return cached[1]
+
+    # The frame is indexed by observation time in Central time, oldest first
+    start_time = historical_frame.index[0]
+    end_time = historical_frame.index[-1]
+    with get_metrics().timer('weather_zones_seconds'):
+        astronomical_zones = get_twilight_table().get_zone_intervals(start_time, end_time)
+    logger.debug(f"Generated {len(astronomical_zones)} astronomical zone intervals")
+
+    if data_version is not None:
+        with _zones_lock:
+            # Only the latest version is ever requested again
+            _zones_cache.clear()
+            _zones_cache[cache_key] = (time.time() + Config.CHART_CACHE_TTL, astronomical_zones)
+
+    return astronomical_zones
+
+def render_chart(chart_type: str, historical_frame: pd.DataFrame, astronomical_zones: List[Dict],
+                 profile: str = 'standard', image_format: str = 'png') -> bytes:
+    """Render one weather chart in the given render profile and image format."""
+    chart_generator = WeatherChartGenerator(profile=profile, image_format=image_format)
+    generate = getattr(chart_generator, f'generate_{chart_type}_chart')
+    with get_metrics().timer('chart_render_seconds', chart=chart_type, profile=profile, image_format=image_format):
+        return generate(historical_frame, astronomical_zones)
+
+def refresh_charts(profiles: Sequence[str] = ('standard',)) -> int:
+    """
+    Render every chart type as PNG for each profile and store them in the chart cache.
+
+    Returns:
+        Number of charts rendered
+    """
+    # Read the version before the data, so a concurrent insert can only make
+    # a cached image newer than its key, never older
+    data_version = get_data_version()
+    historical_frame = get_24_hour_frame(CHART_COLUMNS)
+    astronomical_zones = get_astronomical_zones(historical_frame, data_version)
+
+    # Every chart shares the one prepared frame
+    cache = get_chart_cache()
+    for profile in profiles:
+        for chart_type in CHART_TYPES:
+            image_data = render_chart(chart_type, historical_frame, astronomical_zones, profile)
+            cache.set(chart_type, profile, 'png', HISTORY_WINDOW, data_version, image_data)
+
+    return len(profiles) * len(CHART_TYPES)
+
+def get_chart_image(chart_type: str, profile: str = 'standard', image_format: str = 'png') -> Tuple[bytes, bool]:
+    """
+    Get the current image for a chart type, render profile and format.
+
+    Served from the chart cache when this variant has been rendered (in the
+    background or by an earlier request) for the current data version,
+    otherwise rendered once from the last 24 hours of data and cached. The
+    cache may answer with the previous image while a refresh runs; when
+    there is no image at all yet, a placeholder chart is returned.
+
+    Returns:
+        Tuple of (image bytes, whether the image reflects the current data)
+    """
+    data_version = get_data_version()
+    app = current_app._get_current_object()
+
+    def render() -> bytes:
+        # May run in a background refresh thread, outside the request's app context
+        with app.app_context():
+            historical_frame = get_24_hour_frame(CHART_COLUMNS)
+            astronomical_zones = get_astronomical_zones(historical_frame, data_version)
+            return render_chart(chart_type, historical_frame, astronomical_zones, profile, image_format)
+
+    # Concurrent misses for the same chart share a single render
+    image_data, fresh = get_chart_cache().get_or_render(chart_type, profile, image_format, HISTORY_WINDOW,
+                                                        data_version, render)
+    if image_data is None:
+        chart_generator = WeatherChartGenerator(profile=profile, image_format=image_format)
+        image_data = chart_generator.generate_placeholder_chart("Chart is being updated, please refresh shortly")
+    return image_data, fresh
@@ -0,0 +1,143 @@
+"""
+Solar position backends for astronomical calculations.
+Provides a pure-NumPy NOAA algorithm and an astropy reference implementation.
+"""
+
+import logging
+from typing import Dict, Type
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SolarPositionBackend:
+    """Base class for computing sun altitude at an observatory location."""
+
+    name = 'base'
+
+    def __init__(self, latitude: float, longitude: float, elevation: float):
+        """Initialize the backend with observatory location (degrees, degrees, meters)."""
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+
+    def altitudes(self, unix_seconds: np.ndarray) -> np.ndarray:
+        """
+        Calculate geometric sun altitudes (no refraction).
+
+        Args:
+            unix_seconds: Array of UTC unix timestamps
+
+        Returns:
+            Array of sun altitudes in degrees
+        """
+        raise NotImplementedError
+
+
+class NOAASolarPosition(SolarPositionBackend):
+    """
+    NOAA solar position algorithm (Meeus-based), vectorized with NumPy.
+
+    Accurate to roughly 0.01 degrees in altitude for dates within a few
+    centuries of J2000, which is well within darkness zone requirements.
+    """
+
+    name = 'noaa'
+
+    def altitudes(self, unix_seconds: np.ndarray) -> np.ndarray:
+        unix_seconds = np.asarray(unix_seconds, dtype=float)
+
+        julian_day = unix_seconds / 86400.0 + 2440587.5
+        jc = (julian_day - 2451545.0) / 36525.0  # Julian centuries since J2000
+
+        mean_long = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+        mean_anom = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+        eccentricity = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+
+        equation_of_center = (
+            np.sin(mean_anom) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+            + np.sin(2 * mean_anom) * (0.019993 - 0.000101 * jc)
+            + np.sin(3 * mean_anom) * 0.000289
+        )
+        true_long = np.degrees(mean_long) + equation_of_center
+        omega = np.radians(125.04 - 1934.136 * jc)
+        apparent_long = np.radians(true_long - 0.00569 - 0.00478 * np.sin(omega))
+
+        mean_obliquity = 23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+        obliquity = np.radians(mean_obliquity + 0.00256 * np.cos(omega))
+        declination = np.arcsin(np.sin(obliquity) * np.sin(apparent_long))
+
+        # Equation of time in minutes
+        y = np.tan(obliquity / 2) ** 2
+        equation_of_time = 4 * np.degrees(
+            y * np.sin(2 * mean_long)
+            - 2 * eccentricity * np.sin(mean_anom)
+            + 4 * eccentricity * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+            - 0.5 * y * y * np.sin(4 * mean_long)
+            - 1.25 * eccentricity * eccentricity * np.sin(2 * mean_anom)
+        )
+
+        minutes_of_day = (unix_seconds % 86400.0) / 60.0
+        true_solar_time = (minutes_of_day + equation_of_time + 4 * self.longitude) % 1440
+        hour_angle = np.radians(true_solar_time / 4 - 180)
+
+        latitude = np.radians(self.latitude)
+        cos_zenith = (
+            np.sin(latitude) * np.sin(declination)
+            + np.cos(latitude) * np.cos(declination) * np.cos(hour_angle)
+        )
+        return 90.0 - np.degrees(np.arccos(np.clip(cos_zenith, -1.0, 1.0)))
+
+
+class AstropySolarPosition(SolarPositionBackend):
+    """Reference backend using astropy get_sun and an AltAz transform."""
+
+    name = 'astropy'
+
+    def __init__(self, latitude: float, longitude: float, elevation: float):
+        super().__init__(latitude, longitude, elevation)
+
+        # Imported here so the default backend keeps astropy out of the import graph
+        from astropy.coordinates import EarthLocation
+        from astropy import units as u
+        from .iers import configure_iers
+
+        configure_iers()
+
+        self.location = EarthLocation(
+            lat=latitude * u.deg,
+            lon=longitude * u.deg,
+            height=elevation * u.m
+        )
+
+    def altitudes(self, unix_seconds: np.ndarray) -> np.ndarray:
+        from astropy.time import Time
+        from astropy.coordinates import AltAz, get_sun
+
+        unix_seconds = np.asarray(unix_seconds, dtype=float)
+        if unix_seconds.size == 0:
+            return np.empty(0)
+
+        # One array-valued Time means one get_sun and one AltAz transform
+        time = Time(unix_seconds, format='unix')
+        sun = get_sun(time)
+        altaz_frame = AltAz(obstime=time, location=self.location)
+        sun_altaz = sun.transform_to(altaz_frame)
+
+        return np.atleast_1d(sun_altaz.alt.degree)
+
+
+SOLAR_POSITION_BACKENDS: Dict[str, Type[SolarPositionBackend]] = {
+    NOAASolarPosition.name: NOAASolarPosition,
+    AstropySolarPosition.name: AstropySolarPosition,
+}
+
+def get_solar_position_backend(name: str, latitude: float, longitude: float,
+                               elevation: float) -> SolarPositionBackend:
+    """Create a solar position backend by name."""
+    backend_class = SOLAR_POSITION_BACKENDS.get(name.lower())
+    if backend_class is None:
+        raise ValueError(f"Unknown solar position backend '{name}'. "
+                         f"Available: {', '.join(SOLAR_POSITION_BACKENDS)}")
+
+    logger.info(f"Using '{backend_class.name}' solar position backend")
+    return backend_class(latitude, longitude, elevation)
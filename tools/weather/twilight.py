@@ -0,0 +1,257 @@
+"""
+Per-night twilight transition table.
+Computes exact sunrise, sunset and twilight crossing times once per local night
+and answers darkness zone queries as start/end intervals.
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .astronomy import AstronomyCalculator
+from .models import TwilightNight, db
+from timezone_utils import CENTRAL_TZ, to_utc
+
+logger = logging.getLogger(__name__)
+
+# (altitude threshold, crossing name when setting, crossing name when rising)
+TWILIGHT_THRESHOLDS = [
+    (0.0, 'sunset', 'sunrise'),
+    (-6.0, 'civil_dusk', 'civil_dawn'),
+    (-12.0, 'nautical_dusk', 'nautical_dawn'),
+    (-18.0, 'astronomical_dusk', 'astronomical_dawn'),
+]
+
+# Darkness zone entered at each crossing
+ZONE_AFTER_CROSSING = {
+    'sunset': 'civil_twilight',
+    'civil_dusk': 'nautical_twilight',
+    'nautical_dusk': 'astronomical_twilight',
+    'astronomical_dusk': 'night',
+    'astronomical_dawn': 'astronomical_twilight',
+    'nautical_dawn': 'nautical_twilight',
+    'civil_dawn': 'civil_twilight',
+    'sunrise': 'day',
+}
+
+SAMPLE_INTERVAL_SECONDS = 600   # Coarse grid used to bracket crossings
+BISECTION_ITERATIONS = 12       # 600s / 2**12 ~= 0.15s resolution
+MAX_CACHED_NIGHTS = 366
+
+
+class TwilightTable:
+    """In-memory and database-backed table of twilight crossings per local night."""
+
+    def __init__(self, calculator: Optional[AstronomyCalculator] = None):
+        """Initialize the table for the configured observatory location."""
+        self.calculator = calculator or AstronomyCalculator()
+        self.nights: 'OrderedDict[str, Dict]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def night_of(dt: datetime) -> date:
+        """Return the local night (date of the evening) that a Central datetime belongs to."""
+        return (to_utc(dt).astimezone(CENTRAL_TZ) - timedelta(hours=12)).date()
+
+    @staticmethod
+    def _night_bounds(night_date: date) -> Tuple[float, float]:
+        """Return UTC unix timestamps for local noon of the night and of the following day."""
+        start = datetime.combine(night_date, dt_time(12), tzinfo=CENTRAL_TZ)
+        end = datetime.combine(night_date + timedelta(days=1), dt_time(12), tzinfo=CENTRAL_TZ)
+        return start.timestamp(), end.timestamp()
+
+    def compute_night(self, night_date: date) -> Dict:
+        """
+        Compute crossing times for one night by bisection on sun altitude.
+
+        Args:
+            night_date: Local date of the evening
+
+        Returns:
+            Dictionary with the zone at local noon and sorted (timestamp, crossing) transitions
+        """
+        start_ts, end_ts = self._night_bounds(night_date)
+        grid = np.append(np.arange(start_ts, end_ts, SAMPLE_INTERVAL_SECONDS), end_ts)
+        altitudes = self.calculator.backend.altitudes(grid)
+
+        # Bracket every threshold crossing on the coarse grid
+        lows, highs, thresholds, setting, names = [], [], [], [], []
+        for threshold, setting_name, rising_name in TWILIGHT_THRESHOLDS:
+            above = altitudes > threshold
+            for i in np.nonzero(above[:-1] != above[1:])[0]:
+                lows.append(grid[i])
+                highs.append(grid[i + 1])
+                thresholds.append(threshold)
+                setting.append(bool(above[i]))
+                names.append(setting_name if above[i] else rising_name)
+
+        transitions = []
+        if names:
+            low = np.array(lows)
+            high = np.array(highs)
+            threshold_arr = np.array(thresholds)
+            setting_arr = np.array(setting)
+
+            # Refine all brackets together: one altitude evaluation per iteration
+            for _ in range(BISECTION_ITERATIONS):
+                mid = (low + high) / 2
+                mid_above = self.calculator.backend.altitudes(mid) > threshold_arr
+                move_low = mid_above == setting_arr
+                low = np.where(move_low, mid, low)
+                high = np.where(move_low, high, mid)
+
+            # Whole seconds, so values read back from the database compare equal
+            crossing_times = np.round((low + high) / 2).tolist()
+            transitions = sorted(zip(crossing_times, names))
+
+        return {
+            'night_date': night_date.isoformat(),
+            'start_zone': self.calculator.classify_darkness_zone(altitudes[0]),
+            'transitions': transitions,
+        }
+
+    def _load_night(self, night_date: date) -> Optional[Dict]:
+        """Load a night from the database, if stored."""
+        row = TwilightNight.query.filter_by(
+            night_date=night_date.isoformat(),
+            latitude=self.calculator.latitude,
+            longitude=self.calculator.longitude
+        ).first()
+
+        if row is None:
+            return None
+
+        transitions = []
+        for name in ZONE_AFTER_CROSSING:
+            value = getattr(row, name)
+            if value is not None:
+                transitions.append((value.replace(tzinfo=timezone.utc).timestamp(), name))
+
+        return {
+            'night_date': row.night_date,
+            'start_zone': row.start_zone,
+            'transitions': sorted(transitions),
+        }
+
+    def _store_night(self, night: Dict) -> None:
+        """Persist a computed night to the database."""
+        row = TwilightNight(
+            night_date=night['night_date'],
+            latitude=self.calculator.latitude,
+            longitude=self.calculator.longitude,
+            start_zone=night['start_zone']
+        )
+        for timestamp, name in night['transitions']:
+            if getattr(row, name) is None:
+                setattr(row, name, datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None))
+
+        db.session.add(row)
+        db.session.commit()
+
+    def get_night(self, night_date: date) -> Dict:
+        """Get crossing times for a night from memory, the database, or by computing them."""
+        key = night_date.isoformat()
+        with self.lock:
+            night = self.nights.get(key)
+            if night is not None:
+                self.nights.move_to_end(key)
+                return night
+
+        try:
+            night = self._load_night(night_date)
+        except Exception as e:
+            logger.warning(f"Could not load twilight table for {key}: {e}")
+            db.session.rollback()
+            night = None
+
+        if night is None:
+            night = self.compute_night(night_date)
+            try:
+                self._store_night(night)
+            except Exception as e:
+                # Another worker may have stored it first; the in-memory copy is still valid
+                logger.warning(f"Could not store twilight table for {key}: {e}")
+                db.session.rollback()
+
+        with self.lock:
+            self.nights[key] = night
+            while len(self.nights) > MAX_CACHED_NIGHTS:
+                self.nights.popitem(last=False)
+
+        return night
+
+    def _boundaries(self, first_night: date, last_night: date) -> Tuple[List[float], List[str]]:
+        """Build sorted zone start times and zones covering the given nights."""
+        times, zones = [], []
+        night_date = first_night
+        while night_date <= last_night:
+            night = self.get_night(night_date)
+            times.append(self._night_bounds(night_date)[0])
+            zones.append(night['start_zone'])
+            for timestamp, name in night['transitions']:
+                times.append(timestamp)
+                zones.append(ZONE_AFTER_CROSSING[name])
+            night_date += timedelta(days=1)
+        return times, zones
+
+    def get_zone_intervals(self, start_time: datetime, end_time: datetime) -> List[Dict]:
+        """
+        Get darkness zones for a time range as contiguous intervals.
+
+        Args:
+            start_time: Start of time range (Central time)
+            end_time: End of time range (Central time)
+
+        Returns:
+            List of dictionaries with zone, color, start/end Central times and UTC millisecond timestamps
+        """
+        start_ts = to_utc(start_time).timestamp()
+        end_ts = to_utc(end_time).timestamp()
+        if end_ts <= start_ts:
+            return []
+
+        times, zones = self._boundaries(self.night_of(start_time), self.night_of(end_time))
+
+        intervals = []
+        i = bisect_right(times, start_ts) - 1
+        while i < len(times) and times[i] < end_ts:
+            zone = zones[i]
+            interval_start = max(times[i], start_ts)
+            interval_end = min(times[i + 1], end_ts) if i + 1 < len(times) else end_ts
+
+            if intervals and intervals[-1]['zone'] == zone:
+                # Night windows meet at local noon; merge the split day interval
+                intervals[-1]['end_timestamp'] = interval_end * 1000
+            else:
+                intervals.append({
+                    'zone': zone,
+                    'color': self.calculator.get_zone_color(zone),
+                    'start_timestamp': interval_start * 1000,
+                    'end_timestamp': interval_end * 1000,
+                })
+            i += 1
+
+        for interval in intervals:
+            interval['start'] = self._to_central_naive(interval['start_timestamp'])
+            interval['end'] = self._to_central_naive(interval['end_timestamp'])
+
+        return intervals
+
+    @staticmethod
+    def _to_central_naive(timestamp_ms: float) -> datetime:
+        """Convert a UTC millisecond timestamp to a naive Central datetime."""
+        return datetime.fromtimestamp(timestamp_ms / 1000, tz=CENTRAL_TZ).replace(tzinfo=None)
+
+
+# Global twilight table instance
+_twilight_table = None
+
+def get_twilight_table() -> TwilightTable:
+    """Get the global twilight table instance."""
+    global _twilight_table
+    if _twilight_table is None:
+        _twilight_table = TwilightTable()
+    return _twilight_table